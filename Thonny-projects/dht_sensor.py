@@ -31,15 +31,15 @@ class DHT22Sensor:
         self.last_humidity = None
         self.last_read_time = None
     
-    def _log(self, message, is_error=False):
-        """内部日志方法"""
+    def _log(self, message, *args, is_error=False):
+        """内部日志方法，有 args 时按 message.format(*args) 格式化，级别被过滤时不格式化"""
         if self.logger:
             if is_error:
-                self.logger.error(message)
+                self.logger.error(message, *args)
             else:
-                self.logger.info(message)
+                self.logger.info(message, *args)
         else:
-            print(message)
+            print(message.format(*args) if args else message)
     
     def _led_on(self):
         """LED 指示灯开启"""
@@ -86,21 +86,21 @@ class DHT22Sensor:
                 # 开启 LED 表示读取成功
                 self._led_on()
                 
-                self._log(f"读取成功: 温度={temperature}°C, 湿度={humidity}%")
+                self._log("读取成功: 温度={}°C, 湿度={}%", temperature, humidity)
                 
                 return (temperature, humidity)
                 
             except Exception as e: 
                 self.error_count += 1
-                error_msg = f"读取失败 (尝试 {attempt + 1}/{retry_count}): {type(e).__name__} - {e}"
+                error_msg = "读取失败 (尝试 {}/{}): {} - {}"
                 
                 # 最后一次尝试才记录错误
                 if attempt == retry_count - 1:
-                    self._log(error_msg, is_error=True)
+                    self._log(error_msg, attempt + 1, retry_count, type(e).__name__, e, is_error=True)
                     self._led_off()
                     return None
                 else:
-                    self._log(error_msg)
+                    self._log(error_msg, attempt + 1, retry_count, type(e).__name__, e)
                     time.sleep(retry_delay)
         
         return None
@@ -0,0 +1,20 @@
+"""
+日志消息目录
+消息 ID -> 格式字符串。设备上用 log_event(级别, MSG_xxx, 参数...) 记录日志：
+二进制日志只写入消息 ID 和数值参数，文本日志和电脑端解码（tools/log_decode.py）用这里的格式字符串还原成文字。
+
+新消息在末尾追加新 ID；已有 ID 的参数个数和含义不要改动，否则旧日志无法正确解码。
+每条消息最多 3 个参数，只能是整数（32 位）或浮点数；不符合时二进制日志改为记录格式化后的文本。
+"""
+
+MSG_PUBLISHED = 1        # 温度, 湿度
+MSG_WAITING = 2          # 秒数
+MSG_QUEUE_SENT = 3       # 条数
+MSG_OUTBOX_SENT = 4      # 条数
+
+MESSAGES = {
+    MSG_PUBLISHED: "数据已发布: 温度={:.1f}°C, 湿度={:.1f}%",
+    MSG_WAITING: "等待 {} 秒...",
+    MSG_QUEUE_SENT: "已发送队列消息 {} 条",
+    MSG_OUTBOX_SENT: "已补发离线数据 {} 条",
+}
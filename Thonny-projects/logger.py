@@ -3,7 +3,35 @@
 适用于 Raspberry Pi Pico 等资源受限设备
 """
 
+import os
+import struct
 import time
+from array import array
+
+# 二进制日志记录（固定 20 字节，小端）:
+#   ticks_ms(u32) 消息 ID(u16) 级别(u8) 参数个数|浮点标记<<4(u8) 3 个参数(各 4 字节)
+# 浮点标记第 i 位为 1 表示参数 i 是 float32，否则是 int32；未用的参数为 0。
+# 消息 ID 见 log_messages.py，另有两个特殊 ID:
+MSG_TEXT = 0xFFFF   # 文本消息，参数 0 为 UTF-8 字节数，文本紧跟在记录后
+MSG_CLOCK = 0xFFFE  # 时钟同步，参数 0 为 time.time()，用于把 ticks_ms 换算成时间
+RECORD_SIZE = 20
+MAX_ARGS = 3
+_RECORD_FORMATS = ["<IHBB" + "".join("f" if mask >> i & 1 else "i" for i in range(MAX_ARGS))
+                   for mask in range(1 << MAX_ARGS)]
+_NO_ARGS = (0,) * MAX_ARGS
+
+
+def _packable(args):
+    """参数能否放进二进制记录: 最多 3 个，int32 范围内的整数或 float32 范围内的浮点数"""
+    if len(args) > MAX_ARGS:
+        return False
+    for arg in args:
+        if isinstance(arg, float):
+            if not -3.4e38 < arg < 3.4e38:
+                return False
+        elif not isinstance(arg, int) or not -0x80000000 <= arg <= 0x7FFFFFFF:
+            return False
+    return True
 
 
 class SimpleLogger:
@@ -22,53 +50,129 @@ class SimpleLogger:
         ERROR: "ERROR"
     }
     
-    def __init__(self, filename, max_size=10240, level=INFO, use_timestamp=True):
+    def __init__(self, filename, max_size=10240, level=INFO, use_timestamp=True,
+                 buffer_size=512, flush_interval=30, backups=2, binary=False, memory=None):
         """
         初始化日志记录器
         
         Args:
             filename: 日志文件名
-            max_size: 最大文件大小（字节），默认 10KB，超过后会清空
+            max_size: 单个日志文件的最大大小（字节），默认 10KB，写满后轮转
             level: 日志级别，默认 INFO
             use_timestamp: 是否添加时间戳，默认 True
+            buffer_size: 内存缓冲字节数，缓冲满时写入文件，默认 512，0 表示每行立即写入
+            flush_interval: 缓冲最长保留时间（秒），默认 30，0 表示不按时间写入
+            backups: 保留的旧日志份数（filename.1 ~ filename.N，数字越大越旧），默认 2，
+                     日志共占用不超过 (backups + 1) * max_size 字节；0 表示写满后清空
+            binary: 是否写二进制记录（见 RECORD_SIZE），默认 False；
+                    二进制日志不格式化文字和时间，用 tools/log_decode.py 在电脑上解码
+            memory: MemoryLogger（可选），每行文本日志同时保存到其中，作为出错时转储的最近日志；
+                    二进制模式下只保存文本消息，不保存 event() 记录
         """
         self.filename = filename
         self.max_size = max_size
         self.level = level
         self.use_timestamp = use_timestamp
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.backups = backups
+        self.binary = binary
+        self.memory = memory
+        self.size = 0          # 当前日志文件的字节数，写入时累加，避免反复 stat
+        self.buffer = []       # 尚未写入文件的日志行（UTF-8 编码后的 bytes）
+        self.buffered = 0      # 缓冲中的字节数
+        self.writes = 0        # 写入闪存的次数
+        self.last_flush = time.ticks_ms()
         self.file = None
         self._open_file()
+        if binary:
+            # 每次启动 ticks_ms 从 0 开始，先记录一次时钟
+            self._write_raw(self._clock_record())
     
     def _open_file(self):
-        """打开日志文件"""
+        """打开日志文件（追加），启动时已超过大小上限则先轮转"""
         try:
-            # 检查文件大小
+            self.size = os.stat(self.filename)[6]
+        except OSError:
+            # 文件不存在
+            self.size = 0
+        
+        if self.size > self.max_size:
+            self._rotate()
+            return
+        
+        try:
+            self.file = open(self.filename, "ab")
+        except Exception as e:
+            print(f"无法打开日志文件:  {e}")
+            self.file = None
+    
+    def _rotate(self):
+        """轮转日志: filename.N-1 -> filename.N ... filename -> filename.1，然后新建 filename"""
+        if self.file:
             try:
-                import os
-                file_size = os.stat(self.filename)[6]
-                
-                # 如果文件过大，清空重建
-                if file_size > self.max_size:
-                    self.file = open(self.filename, "w")
-                    self._write_raw("=== 日志文件已重置 ===\n")
-                else:
-                    self.file = open(self.filename, "a")
+                self.file.close()
+            except Exception:
+                pass
+        
+        if self.backups:
+            # 删除最旧的一份，其余依次后移（文件不存在时忽略）
+            try:
+                os.remove(f"{self.filename}.{self.backups}")
+            except OSError:
+                pass
+            for i in range(self.backups - 1, 0, -1):
+                try:
+                    os.rename(f"{self.filename}.{i}", f"{self.filename}.{i + 1}")
+                except OSError:
+                    pass
+            try:
+                os.rename(self.filename, f"{self.filename}.1")
             except OSError:
-                # 文件不存在，创建新文件
-                self.file = open(self.filename, "w")
-                
+                pass
+        
+        try:
+            self.file = open(self.filename, "wb")
         except Exception as e:
             print(f"无法打开日志文件:  {e}")
             self.file = None
+        self.size = 0
     
     def _write_raw(self, message):
-        """直接写入消息到文件"""
-        if self.file:
-            try:
-                self.file.write(message)
+        """把消息加入缓冲，缓冲已满或超过保留时间时写入文件"""
+        if not self.file:
+            return
+        self.buffer.append(message)
+        self.buffered += len(message)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+        elif self.flush_interval and time.ticks_diff(
+                time.ticks_ms(), self.last_flush) >= self.flush_interval * 1000:
+            self.flush()
+    
+    def flush(self):
+        """把缓冲中的日志写入文件（休眠、断电前调用）"""
+        self.last_flush = time.ticks_ms()
+        if not self.buffer or not self.file:
+            return
+        data = b"".join(self.buffer)
+        
+        # 当前文件写不下时先轮转，二进制日志的新文件以时钟记录开头
+        if self.size and self.size + len(data) > self.max_size:
+            self._rotate()
+            if self.binary:
+                data = self._clock_record() + data
+        
+        try:
+            if self.file:
+                self.file.write(data)
                 self.file.flush()
-            except Exception as e:
-                print(f"写入日志失败: {e}")
+                self.size += len(data)
+                self.writes += 1
+        except Exception as e:
+            print(f"写入日志失败: {e}")
+        self.buffer.clear()
+        self.buffered = 0
     
     def _get_timestamp(self):
         """获取简单的时间戳"""
@@ -83,10 +187,73 @@ class SimpleLogger:
         except:
             return ""
     
-    def _log(self, level, message):
-        """内部日志方法"""
+    def _record(self, level, msg_id, args):
+        """打包一条二进制日志记录"""
+        mask = 0
+        for i in range(len(args)):
+            if isinstance(args[i], float):
+                mask |= 1 << i
+        return struct.pack(_RECORD_FORMATS[mask], time.ticks_ms() & 0xFFFFFFFF, msg_id, level,
+                           len(args) | mask << 4, *(args + _NO_ARGS[len(args):]))
+    
+    def _clock_record(self):
+        """时钟同步记录: 当前 ticks_ms 对应的 time.time()"""
+        return self._record(self.INFO, MSG_CLOCK, (int(time.time()),))
+    
+    def event(self, level, msg_id, *args):
+        """
+        按消息 ID 记录日志
+        
+        二进制模式只写入消息 ID 和参数，不格式化、不输出到控制台；
+        文本模式按 log_messages.MESSAGES 格式化后记录。
+        参数放不进二进制记录时（见 args），二进制模式也按格式化后的文本消息记录。
+        
+        Args:
+            level: 日志级别
+            msg_id: 消息 ID（log_messages.MSG_xxx）
+            *args: 最多 3 个 int32 整数或浮点数参数
+        """
         if level < self.level:
             return
+        if not self.binary or not _packable(args):
+            from log_messages import MESSAGES
+            self._log(level, MESSAGES[msg_id], args)
+            return
+        self._write_raw(self._record(level, msg_id, args))
+        if level >= self.ERROR:
+            self.flush()
+    
+    def enabled(self, level):
+        """
+        该级别的日志是否会被记录
+        
+        Args:
+            level: 日志级别
+            
+        Returns:
+            bool: 会被记录返回 True
+        """
+        return level >= self.level
+    
+    def _log(self, level, message, args=()):
+        """内部日志方法，级别被过滤时不格式化消息"""
+        if level < self.level:
+            return
+        
+        if args:
+            message = message.format(*args)
+        
+        if self.binary:
+            # 二进制日志中的文本消息
+            text = str(message).encode()
+            self._write_raw(self._record(level, MSG_TEXT, (len(text),)) + text)
+            if level >= self.ERROR:
+                self.flush()
+            line = f"[{self.LEVEL_NAMES[level]}] {message}"
+            if self.memory is not None:
+                self.memory.append(line)
+            print(line)
+            return
         
         # 构建日志消息
         parts = []
@@ -104,31 +271,36 @@ class SimpleLogger:
         
         log_line = " ".join(parts) + "\n"
         
-        # 写入文件
-        self._write_raw(log_line)
+        # 写入缓冲，ERROR 立即写入文件
+        self._write_raw(log_line.encode())
+        if level >= self.ERROR:
+            self.flush()
+        if self.memory is not None:
+            self.memory.append(log_line[:-1])
         
         # 同时输出到控制台（可选）
         print(log_line. rstrip())
     
-    def debug(self, message):
-        """记录 DEBUG 级别日志"""
-        self._log(self.DEBUG, message)
+    def debug(self, message, *args):
+        """记录 DEBUG 级别日志，有 args 时按 message.format(*args) 格式化"""
+        self._log(self.DEBUG, message, args)
     
-    def info(self, message):
-        """记录 INFO 级别日志"""
-        self._log(self.INFO, message)
+    def info(self, message, *args):
+        """记录 INFO 级别日志，有 args 时按 message.format(*args) 格式化"""
+        self._log(self.INFO, message, args)
     
-    def warning(self, message):
-        """记录 WARNING 级别日志"""
-        self._log(self.WARNING, message)
+    def warning(self, message, *args):
+        """记录 WARNING 级别日志，有 args 时按 message.format(*args) 格式化"""
+        self._log(self.WARNING, message, args)
     
-    def error(self, message):
-        """记录 ERROR 级别日志"""
-        self._log(self.ERROR, message)
+    def error(self, message, *args):
+        """记录 ERROR 级别日志，有 args 时按 message.format(*args) 格式化"""
+        self._log(self.ERROR, message, args)
     
     def close(self):
-        """关闭日志文件"""
+        """写入缓冲并关闭日志文件"""
         if self.file:
+            self.flush()
             try:
                 self.file.close()
             except:
@@ -140,18 +312,41 @@ class SimpleLogger:
         self.close()
 
 
-class MemoryLogger: 
-    """内存日志记录器（不写文件，仅保存在内存中）"""
+class MemoryLogger:
+    """
+    内存日志记录器（不写文件，仅保存在内存中）
     
-    def __init__(self, max_lines=50):
+    预先分配的环形缓冲区：写满后覆盖最旧的日志，每条 O(1)，不移动已有日志。
+    可作为常驻的崩溃日志缓冲（SimpleLogger 的 memory 参数），出错时用
+    save_to_file() 写入 Flash 或用 publish() 通过 MQTT 上报。
+    """
+    
+    def __init__(self, max_lines=50, max_bytes=0):
         """
         初始化内存日志记录器
         
         Args:
             max_lines: 最大保存行数，默认 50 行
+            max_bytes: 大于 0 时日志以 UTF-8 保存在预先分配的 max_bytes 字节缓冲区中，
+                       总字节数不超过该值（超长的单行被截断）；默认 0，保存为字符串列表
         """
         self.max_lines = max_lines
-        self.logs = []
+        self.max_bytes = max_bytes
+        self.first = 0  # 最旧一条日志的槽位
+        self.count = 0  # 日志条数
+        if max_bytes:
+            # 第 i 条日志位于 arena[starts[i]:starts[i] + lens[i]]，按写入顺序首尾相接
+            self.logs = None
+            self.arena = bytearray(max_bytes)
+            self._mv = memoryview(self.arena)
+            self.starts = array("I", bytes(4 * max_lines))
+            self.lens = array("I", bytes(4 * max_lines))
+            self._wpos = 0  # 下一条日志的写入位置
+        else:
+            self.logs = [None] * max_lines
+    
+    def __len__(self):
+        return self.count
     
     def log(self, message):
         """记录日志到内存"""
@@ -165,17 +360,82 @@ class MemoryLogger:
         except:
             log_line = str(message)
         
-        self.logs.append(log_line)
+        self.append(log_line)
+        print(log_line)
+    
+    def append(self, line):
+        """
+        原样保存一行日志（不加时间戳、不输出到控制台）
         
-        # 保持在最大行数限制内
-        if len(self.logs) > self.max_lines:
-            self.logs.pop(0)
+        Args:
+            line: 日志行（str 或 bytes）
+        """
+        if not self.max_bytes:
+            self.logs[(self.first + self.count) % self.max_lines] = line
+            if self.count < self.max_lines:
+                self.count += 1
+            else:
+                self.first = (self.first + 1) % self.max_lines
+            return
         
-        print(log_line)
+        data = line.encode() if isinstance(line, str) else line
+        n = len(data)
+        if n > self.max_bytes:
+            # 截断，不切开 UTF-8 字符
+            n = self.max_bytes
+            while n and data[n] & 0xC0 == 0x80:
+                n -= 1
+        
+        if self._wpos + n > self.max_bytes:
+            # 尾部放不下: 丢弃尾部上一圈的日志，从头写
+            while self.count and self.starts[self.first] >= self._wpos:
+                self._drop()
+            self._wpos = 0
+        
+        # 丢弃被新日志覆盖的最旧日志（上一圈中起点落在新日志范围内的，包括空行），
+        # 槽位用完时也丢弃最旧一条
+        end = self._wpos + n
+        while self.count and (self.count == self.max_lines or (
+                self._wpos <= self.starts[self.first] < end)):
+            self._drop()
+        
+        i = (self.first + self.count) % self.max_lines
+        self.starts[i] = self._wpos
+        self.lens[i] = n
+        self._mv[self._wpos:end] = memoryview(data)[:n]
+        self._wpos = end
+        self.count += 1
+    
+    def _drop(self):
+        """丢弃最旧一条日志"""
+        self.first = (self.first + 1) % self.max_lines
+        self.count -= 1
+    
+    def entries(self, last_n=None):
+        """
+        从旧到新遍历日志，不复制
+        
+        max_bytes 模式下得到的是缓冲区的 memoryview，只在下次记录日志前有效。
+        
+        Args:
+            last_n: 只遍历最后 N 条，默认全部
+            
+        Yields:
+            str 或 memoryview: 日志行（不含换行符）
+        """
+        n = self.count
+        if last_n and last_n < n:
+            n = last_n
+        for k in range(self.count - n, self.count):
+            i = (self.first + k) % self.max_lines
+            if self.max_bytes:
+                yield self._mv[self.starts[i]:self.starts[i] + self.lens[i]]
+            else:
+                yield self.logs[i]
     
     def get_logs(self, last_n=None):
         """
-        获取日志
+        获取日志（复制为字符串列表，遍历请用 entries()）
         
         Args:
             last_n: 获取最后 N 条，默认全部
@@ -183,50 +443,92 @@ class MemoryLogger:
         Returns:
             list: 日志列表
         """
-        if last_n: 
-            return self.logs[-last_n:]
-        return self. logs. copy()
+        if self.max_bytes:
+            return [str(bytes(line), "utf-8") for line in self.entries(last_n)]
+        return list(self.entries(last_n))
     
     def clear(self):
         """清空日志"""
-        self.logs.clear()
+        self.first = 0
+        self.count = 0
+        if self.max_bytes:
+            self._wpos = 0
+        else:
+            self.logs = [None] * self.max_lines
+    
+    def _chunks(self):
+        """逐段给出全部日志（每行后跟换行符），供 publish_stream 使用"""
+        for line in self.entries():
+            yield line.encode() if isinstance(line, str) else line
+            yield b"\n"
     
     def save_to_file(self, filename):
         """
-        保存日志到文件
+        保存日志到文件（例如出错时写入 Flash）
         
         Args:
             filename: 文件名
         """
         try:
-            with open(filename, "w") as f:
-                for log in self.logs:
-                    f.write(log + "\n")
+            with open(filename, "wb") as f:
+                for chunk in self._chunks():
+                    f.write(chunk)
             print(f"日志已保存到 {filename}")
             return True
         except Exception as e: 
             print(f"保存日志失败: {e}")
             return False
+    
+    def publish(self, client, topic, retain=False, qos=0):
+        """
+        把全部日志作为一条 MQTT 消息发布（每行一条日志），例如出错时上报
+        
+        max_bytes 模式下通过 publish_stream 直接从缓冲区发送，不复制日志。
+        
+        Args:
+            client: 已连接的 MQTTClient
+            topic: 主题
+            retain: 是否为保留消息
+            qos: QoS
+        """
+        size = 0
+        for chunk in self._chunks():
+            size += len(chunk)
+        client.publish_stream(topic, size, self._chunks(), retain, qos)
 
 
 # ==================== 全局日志实例 ====================
+# 日志级别（供 log_event、log_enabled 使用）
+DEBUG = SimpleLogger.DEBUG
+INFO = SimpleLogger.INFO
+WARNING = SimpleLogger.WARNING
+ERROR = SimpleLogger.ERROR
+
 _global_logger = None
 
 
-def init_logger(filename="_log.txt", max_size=10240, level=SimpleLogger.INFO):
+def init_logger(filename="_log.txt", max_size=10240, level=SimpleLogger.INFO,
+                buffer_size=512, flush_interval=30, backups=2, binary=False, memory=None):
     """
     初始化全局日志记录器
     
     Args: 
         filename: 日志文件名
-        max_size:  最大文件大小（字节）
+        max_size:  单个日志文件的最大大小（字节）
         level: 日志级别
+        buffer_size: 内存缓冲字节数，0 表示每行立即写入
+        flush_interval: 缓冲最长保留时间（秒）
+        backups: 保留的旧日志份数
+        binary: 是否写二进制日志
+        memory: 同时保存最近日志的 MemoryLogger（可选）
         
     Returns:
         SimpleLogger: 日志记录器实例
     """
     global _global_logger
-    _global_logger = SimpleLogger(filename, max_size, level)
+    _global_logger = SimpleLogger(filename, max_size, level,
+                                  buffer_size=buffer_size, flush_interval=flush_interval,
+                                  backups=backups, binary=binary, memory=memory)
     return _global_logger
 
 
@@ -240,33 +542,70 @@ def get_logger():
     return _global_logger
 
 
-def log_info(message):
-    """记录 INFO 日志（便捷函数）"""
+def log_enabled(level):
+    """
+    指定级别的日志是否会被记录（未初始化时输出到控制台，视为全部记录）
+    
+    用于跳过只为写日志而准备数据的代码，例如:
+        if log_enabled(DEBUG):
+            log_debug("统计: {}", sensor.get_statistics())
+    
+    Args:
+        level: 日志级别
+        
+    Returns:
+        bool: 会被记录返回 True
+    """
+    return _global_logger is None or level >= _global_logger.level
+
+
+def _format(message, args):
+    """有参数时格式化消息"""
+    return message.format(*args) if args else message
+
+
+def flush_log():
+    """把全局日志记录器缓冲中的日志写入文件（便捷函数）"""
+    if _global_logger:
+        _global_logger.flush()
+
+
+def log_event(level, msg_id, *args):
+    """按消息 ID 记录日志（便捷函数），见 SimpleLogger.event"""
+    if _global_logger:
+        _global_logger.event(level, msg_id, *args)
+    else:
+        from log_messages import MESSAGES
+        print(f"[{SimpleLogger.LEVEL_NAMES[level]}] {_format(MESSAGES[msg_id], args)}")
+
+
+def log_info(message, *args):
+    """记录 INFO 日志（便捷函数），有 args 时按 message.format(*args) 格式化"""
     if _global_logger:
-        _global_logger.info(message)
+        _global_logger.info(message, *args)
     else:
-        print(f"[INFO] {message}")
+        print(f"[INFO] {_format(message, args)}")
 
 
-def log_error(message):
-    """记录 ERROR 日志（便捷函数）"""
+def log_error(message, *args):
+    """记录 ERROR 日志（便捷函数），有 args 时按 message.format(*args) 格式化"""
     if _global_logger:
-        _global_logger.error(message)
+        _global_logger.error(message, *args)
     else:
-        print(f"[ERROR] {message}")
+        print(f"[ERROR] {_format(message, args)}")
 
 
-def log_warning(message):
-    """记录 WARNING 日志（便捷函数）"""
+def log_warning(message, *args):
+    """记录 WARNING 日志（便捷函数），有 args 时按 message.format(*args) 格式化"""
     if _global_logger:
-        _global_logger.warning(message)
+        _global_logger.warning(message, *args)
     else:
-        print(f"[WARNING] {message}")
+        print(f"[WARNING] {_format(message, args)}")
 
 
-def log_debug(message):
-    """记录 DEBUG 日志（便捷函数）"""
+def log_debug(message, *args):
+    """记录 DEBUG 日志（便捷函数），有 args 时按 message.format(*args) 格式化"""
     if _global_logger: 
-        _global_logger.debug(message)
+        _global_logger.debug(message, *args)
     else:
-        print(f"[DEBUG] {message}")
\ No newline at end of file
+        print(f"[DEBUG] {_format(message, args)}")
\ No newline at end of file
@@ -8,9 +8,13 @@ import json
 import time
 from machine import Pin
 from umqtt.simple import MQTTClient
+from umqtt.pool import BrokerPool
 from network_utils import WiFiManager, NTPTimeSync
-from logger import init_logger, log_info, log_error, log_warning, get_logger
+from logger import init_logger, log_info, log_error, log_warning, get_logger, flush_log, log_event, INFO, MemoryLogger
+from log_messages import MSG_PUBLISHED, MSG_WAITING, MSG_QUEUE_SENT, MSG_OUTBOX_SENT
 from dht_sensor import DHT22Sensor
+from outbox import Outbox
+from send_queue import SendQueue, CRITICAL, BULK, KEEP_LATEST
 
 
 # ==================== 配置常量 ====================
@@ -25,10 +29,24 @@ WIFI_PASSWORD = "******"
 # MQTT 配置
 MQTT_HOST = "192.168.1.157"
 MQTT_PORT = 1883
+# 可用的 MQTT 服务器（按优先顺序），连接失败或断开时切换到评分最好的另一台
+MQTT_BROKERS = [
+    (MQTT_HOST, MQTT_PORT),
+    ("192.168.31.11", 1883),
+]
 MQTT_TOPIC = "sensor/dht22/2/data"
+MQTT_STATS_TOPIC = "sensor/dht22/2/stats"  # 传感器与 MQTT 传输统计
+MQTT_ALARM_TOPIC = "sensor/dht22/2/alarm"  # 告警（传感器故障等），优先发送
+MQTT_CRASH_TOPIC = "sensor/dht22/2/crash"  # 主循环异常时上报最近的日志
 MQTT_USER = b"******"
 MQTT_PASSWORD = b"******"
 MQTT_CLIENT_ID = "WCwsVCBZa1xcSlRTUzwsaXkiUXlwOVVgKg"
+MQTT_MAX_INFLIGHT = 8   # 补发离线数据时的流水线深度
+MQTT_KEEPALIVE = 60     # 心跳周期（秒），空闲 30 秒发送一次 PINGREQ
+MQTT_POLL_INTERVAL = 5  # 等待采集期间处理 MQTT 心跳的间隔（秒）
+MQTT_TIMEOUT = 10       # 连接、等待应答时无数据的最长时间（秒），超时后重连
+MQTT_COMPRESS_THRESHOLD = 0  # 大于 0 时压缩不小于该字节数的消息（订阅端需能解压，见 umqtt/compress.py）
+MQTT_VERSION = 4        # 协议版本，5 = MQTT 5（主题别名，每条消息少发主题字符串，需服务器支持）
 
 # 时区配置
 TIMEZONE_OFFSET = 8  # UTC+8 (北京时间)
@@ -38,7 +56,22 @@ SAMPLE_INTERVAL = 300
 
 # 日志配置
 LOG_FILE = "_log.txt"
-LOG_MAX_SIZE = 10240  # 10KB
+LOG_BINARY = False    # True 时写二进制日志 _log.bin（更省 CPU 和 Flash，用 tools/log_decode.py 解码）
+LOG_MAX_SIZE = 10240  # 单个日志文件 10KB，写满后轮转
+LOG_BACKUPS = 2       # 保留 _log.txt.1、_log.txt.2 两份旧日志，共占用不超过 30KB Flash
+LOG_BUFFER_SIZE = 512     # 日志先缓存在内存，满 512 字节写一次 Flash（ERROR 立即写入）
+LOG_FLUSH_INTERVAL = 30   # 缓存的日志最多保留 30 秒
+CRASH_LOG_LINES = 40      # 内存中常驻最近 40 行日志，主循环异常时转储
+CRASH_LOG_BYTES = 2048    # 最近日志预先分配 2KB 内存
+CRASH_LOG_FILE = "_crash.txt"
+
+# 离线发件箱配置
+OUTBOX_PREFIX = "_outbox"
+OUTBOX_SEGMENT_SIZE = 4096
+OUTBOX_MAX_SEGMENTS = 8  # 最多占用 32KB Flash
+
+# 发送队列配置（告警和统计信息，只保留每个主题最新的一条）
+SEND_QUEUE_SIZE = 16
 
 
 # ==================== 全局变量 ====================
@@ -46,12 +79,21 @@ led_pin = Pin(LED_PIN, Pin.OUT)
 wifi_manager = None
 time_sync = None
 sensor = None
+outbox = None
+send_queue = None
+mqtt_client = None
+broker_pool = None
+crash_log = None
 
 
 # ==================== 初始化模块 ====================
 def initialize_logger():
     """初始化日志系统"""
-    logger = init_logger(LOG_FILE, LOG_MAX_SIZE)
+    global crash_log
+    crash_log = MemoryLogger(CRASH_LOG_LINES, CRASH_LOG_BYTES)
+    logger = init_logger("_log.bin" if LOG_BINARY else LOG_FILE, LOG_MAX_SIZE,
+                         buffer_size=LOG_BUFFER_SIZE, flush_interval=LOG_FLUSH_INTERVAL,
+                         backups=LOG_BACKUPS, binary=LOG_BINARY, memory=crash_log)
     log_info("=== 程序启动 ===")
     return logger
 
@@ -75,7 +117,7 @@ def initialize_network():
     if not time_sync.sync():
         log_warning("时间同步失败，将使用系统时间")
     else:
-        log_info(f"当前时间: {time_sync.get_iso8601_time()}")
+        log_info("当前时间: {}", time_sync.get_iso8601_time())
     
     return True
 
@@ -95,102 +137,307 @@ def initialize_sensor():
     return sensor
 
 
+def initialize_outbox():
+    """初始化离线发件箱"""
+    global outbox
+    
+    outbox = Outbox(OUTBOX_PREFIX, OUTBOX_SEGMENT_SIZE, OUTBOX_MAX_SEGMENTS)
+    if outbox.pending():
+        log_info("发件箱中有待补发的数据")
+    return outbox
+
+
+def initialize_send_queue():
+    """初始化发送队列：告警最先发送，统计信息最后发送，同一主题只保留最新一条"""
+    global send_queue
+    
+    send_queue = SendQueue(SEND_QUEUE_SIZE)
+    send_queue.set_policy(MQTT_ALARM_TOPIC, keep=KEEP_LATEST, priority=CRITICAL, qos=1)
+    send_queue.set_policy(MQTT_STATS_TOPIC, keep=KEEP_LATEST, priority=BULK)
+    return send_queue
+
+
+def initialize_mqtt():
+    """
+    创建 MQTT 客户端
+    
+    客户端只创建一次，重连时复用，保留已编码的 CONNECT 报文和尚未确认的消息。
+    连接哪台服务器由服务器池根据各服务器的连接延迟和失败次数决定。
+    """
+    global mqtt_client, broker_pool
+    
+    broker_pool = BrokerPool(MQTT_BROKERS)
+    mqtt_client = MQTTClient(
+        client_id=MQTT_CLIENT_ID,
+        server=MQTT_HOST,
+        port=MQTT_PORT,
+        user=MQTT_USER,
+        password=MQTT_PASSWORD,
+        keepalive=MQTT_KEEPALIVE,
+        max_inflight=MQTT_MAX_INFLIGHT,
+        version=MQTT_VERSION,
+        timeout_ms=MQTT_TIMEOUT * 1000
+    )
+    if MQTT_COMPRESS_THRESHOLD and not mqtt_client.set_compression(MQTT_COMPRESS_THRESHOLD):
+        log_warning("固件不支持压缩，消息将不压缩发送")
+    return mqtt_client
+
+
+# ==================== MQTT 连接 ====================
+def connect_mqtt():
+    """
+    连接 MQTT 服务器，先发送队列中的告警等消息，再补发发件箱中的离线数据
+    
+    Returns:
+        bool: 连接成功返回 True，失败返回 False
+    """
+    try:
+        # 检查 WiFi 连接
+        if not wifi_manager.is_connected():
+            log_warning("WiFi 断开，尝试重连...")
+            if not wifi_manager.connect():
+                raise Exception("WiFi 重连失败")
+        
+        # 连接到评分最好的 MQTT 服务器
+        broker_pool.connect(mqtt_client)
+        log_info("已连接到 MQTT 服务器: {}:{}", mqtt_client.server, mqtt_client.port)
+        
+        # 先发送队列中的消息（告警优先），再补发离线期间缓存的数据
+        if send_queue.pending():
+            count = send_queue.flush(mqtt_client)
+            log_event(INFO, MSG_QUEUE_SENT, count)
+        
+        if outbox.pending():
+            damaged = outbox.damaged
+            count = outbox.drain(mqtt_client)
+            log_event(INFO, MSG_OUTBOX_SENT, count)
+            if outbox.damaged > damaged:
+                log_warning("离线数据中有损坏的记录，{} 个分段未能全部补发",
+                            outbox.damaged - damaged)
+        
+        return True
+        
+    except Exception as e:
+        log_error("MQTT 连接失败: {} - {}", type(e).__name__, e)
+        log_info("MQTT 服务器状态: {}", broker_pool.status())
+        disconnect_mqtt()
+        return False
+
+
+def disconnect_mqtt():
+    """断开 MQTT 连接（忽略错误）"""
+    try:
+        mqtt_client.disconnect()
+        log_info("MQTT 已断开")
+    except:
+        pass
+
+
 # ==================== MQTT 数据发布 ====================
-def publish_sensor_data(mqtt_client):
-    """读取传感器数据并发布到 MQTT"""
+def publish_sensor_data(connected):
+    """
+    读取传感器数据并发布到 MQTT
+    
+    MQTT 未连接或发布失败时，数据存入离线发件箱，重连后补发。
+    
+    Args:
+        connected: MQTT 当前是否已连接
+    
+    Returns:
+        bool: MQTT 连接不可用（需要重连）时返回 False
+    """
     # 读取传感器数据（自动重试 3 次）
     result = sensor.read(retry_count=3, retry_delay=2)
     
     if result is None:
         log_error("传感器读取失败")
+        send_queue.put(MQTT_ALARM_TOPIC, json.dumps({
+            "created_at": time_sync.get_iso8601_time(),
+            "error": "sensor read failed",
+            "errors": sensor.error_count,
+        }))
+        return flush_send_queue(connected)
+    
+    temperature, humidity = result
+    
+    # 构造数据包
+    data = {
+        "created_at": time_sync.get_iso8601_time(),
+        "temperature": temperature,
+        "humidity": humidity,
+    }
+    
+    # 序列化为 JSON
+    json_data = json.dumps(data)
+    
+    if not connected:
+        outbox.put(MQTT_TOPIC, json_data)
+        log_warning("MQTT 未连接，数据已存入发件箱")
         return False
     
     try:
-        temperature, humidity = result
-        
-        # 构造数据包
-        data = {
-            "created_at": time_sync.get_iso8601_time(),
-            "temperature": temperature,
-            "humidity": humidity,
-        }
-        
-        # 序列化为 JSON 并发布
-        json_data = json.dumps(data)
         mqtt_client.publish(MQTT_TOPIC, json_data)
+        log_event(INFO, MSG_PUBLISHED, temperature, humidity)
+        return True
         
-        log_info(f"数据已发布: 温度={temperature}°C, 湿度={humidity}%")
+    except Exception as e:
+        outbox.put(MQTT_TOPIC, json_data)
+        log_error("发布数据失败，已存入发件箱: {}", e)
+        return False
+
+
+def publish_statistics(connected):
+    """
+    记录传感器统计和 MQTT 传输统计，并通过发送队列发布
+    
+    Args:
+        connected: MQTT 当前是否已连接
+    
+    Returns:
+        bool: MQTT 连接不可用（需要重连）时返回 False
+    """
+    stats = sensor.get_statistics()
+    metrics = mqtt_client.metrics()
+    log_info("传感器统计:  {}", stats)
+    log_info("MQTT 统计: {}", metrics)
+    
+    send_queue.put(MQTT_STATS_TOPIC, json.dumps({"sensor": stats, "mqtt": metrics}))
+    return flush_send_queue(connected)
+
+
+def flush_send_queue(connected):
+    """
+    发送队列中的消息（告警优先）
+    
+    MQTT 未连接或发送失败时消息留在队列中，重连后发送；同一主题只保留最新一条。
+    
+    Args:
+        connected: MQTT 当前是否已连接
+    
+    Returns:
+        bool: MQTT 连接不可用（需要重连）时返回 False
+    """
+    if not connected:
+        return False
+    
+    try:
+        send_queue.flush(mqtt_client)
         return True
         
     except Exception as e:
-        log_error(f"发布数据失败: {e}")
+        log_error("发送队列消息失败: {}", e)
         return False
 
 
+def wait_next_sample(connected):
+    """
+    等待下次采集，期间定期处理 MQTT 消息并维持心跳
+    
+    Args:
+        connected: MQTT 当前是否已连接
+    
+    Returns:
+        bool: MQTT 连接失效（需要重连）时返回 False
+    """
+    deadline = time.ticks_add(time.ticks_ms(), SAMPLE_INTERVAL * 1000)
+    
+    # 等待期间很少有新日志，先把缓存的日志写入 Flash
+    flush_log()
+    
+    while True:
+        remaining = time.ticks_diff(deadline, time.ticks_ms())
+        if remaining <= 0:
+            return True
+        
+        if connected:
+            try:
+                # 一次读到的多条消息都在接收缓冲区里，全部处理完
+                mqtt_client.check_msg()
+                while mqtt_client.pending():
+                    mqtt_client.check_msg()
+            except Exception as e:
+                log_error("MQTT 连接异常: {}", e)
+                return False
+            
+            if not mqtt_client.healthy:
+                log_warning("MQTT 心跳超时，连接已失效")
+                return False
+        
+        time.sleep_ms(min(remaining, MQTT_POLL_INTERVAL * 1000))
+
+
+def dump_crash_log(connected):
+    """
+    把内存中最近的日志写入 Flash，MQTT 仍连接时同时上报
+    
+    Args:
+        connected: MQTT 当前是否已连接
+    """
+    crash_log.save_to_file(CRASH_LOG_FILE)
+    if connected:
+        try:
+            crash_log.publish(mqtt_client, MQTT_CRASH_TOPIC)
+        except Exception as e:
+            log_warning("上报最近日志失败: {}", e)
+
+
 # ==================== 主循环 ====================
 def start_main_loop():
-    """主循环:  连接 MQTT 并定期发布传感器数据"""
+    """主循环:  定期采集传感器数据并发布，MQTT 不可用时缓存到发件箱"""
     log_info("启动主循环")
-    mqtt_client = None
+    connected = False
     
     try:
-        # 检查 WiFi 连接
-        if not wifi_manager.is_connected():
-            log_warning("WiFi 断开，尝试重连...")
-            if not wifi_manager.connect():
-                raise Exception("WiFi 重连失败")
-        
-        # 连接到 MQTT 服务器
-        mqtt_client = MQTTClient(
-            client_id=MQTT_CLIENT_ID,
-            server=MQTT_HOST,
-            port=MQTT_PORT,
-            user=MQTT_USER,
-            password=MQTT_PASSWORD
-        )
-        mqtt_client.connect()
-        log_info(f"已连接到 MQTT 服务器: {MQTT_HOST}:{MQTT_PORT}")
-        
         # 主循环
         loop_count = 0
         while True:
             loop_count += 1
             
-            # 发布传感器数据
-            publish_sensor_data(mqtt_client)
+            # 未连接时（重新）连接 MQTT 服务器
+            if not connected:
+                connected = connect_mqtt()
             
-            # 每 10 次循环显示一次统计信息
+            # 发布传感器数据，连接失效时断开，下次循环重连
+            if not publish_sensor_data(connected):
+                if connected:
+                    disconnect_mqtt()
+                connected = False
+            
+            # 每 10 次循环记录并发布一次统计信息
             if loop_count % 10 == 0:
-                stats = sensor.get_statistics()
-                log_info(f"传感器统计:  {stats}")
+                if not publish_statistics(connected):
+                    if connected:
+                        disconnect_mqtt()
+                    connected = False
             
-            # 等待下次采集
-            log_info(f"等待 {SAMPLE_INTERVAL} 秒...")
-            time.sleep(SAMPLE_INTERVAL)
+            # 等待下次采集（期间维持 MQTT 心跳），连接失效时断开，下次循环重连
+            log_event(INFO, MSG_WAITING, SAMPLE_INTERVAL)
+            if not wait_next_sample(connected):
+                if connected:
+                    disconnect_mqtt()
+                connected = False
             
     except KeyboardInterrupt:
         log_info("程序被用户中断")
         print("程序已停止")
         
     except Exception as e:
-        log_error(f"主循环异常: {type(e).__name__} - {e}")
+        log_error("主循环异常: {} - {}", type(e).__name__, e)
+        dump_crash_log(connected)
         
     finally:
         # 清理资源
-        if mqtt_client: 
-            try:
-                mqtt_client.disconnect()
-                log_info("MQTT 已断开")
-            except: 
-                pass
+        if connected:
+            disconnect_mqtt()
         
         # 显示最终统计
         if sensor: 
             stats = sensor.get_statistics()
-            log_info(f"最终统计: {stats}")
+            log_info("最终统计: {}", stats)
         
         # 等待后重启循环
         log_warning("6 秒后重启...")
+        flush_log()
         time.sleep(6)
         start_main_loop()
 
@@ -206,8 +453,11 @@ def main():
         log_error("网络初始化失败，程序退出")
         return
     
-    # 3. 初始化传感器
+    # 3. 初始化传感器、离线发件箱、发送队列和 MQTT 客户端
     initialize_sensor()
+    initialize_outbox()
+    initialize_send_queue()
+    initialize_mqtt()
     
     # 4. 点亮 LED 表示就绪
     led_pin.on()
@@ -0,0 +1,211 @@
+"""
+离线发件箱模块
+网络或 MQTT 服务器不可用时把待发送消息保存到 Flash，恢复连接后批量补发
+"""
+
+import os
+import struct
+
+# 记录头: 标记字节, 标志位 (qos | retain << 2), 主题长度, 负载长度
+_MAGIC = 0xA5
+_HEADER = "<BBHH"
+_HEADER_SIZE = 6
+
+
+class Outbox:
+    """Flash 持久化发件箱"""
+
+    def __init__(self, prefix="_outbox", segment_size=4096, max_segments=4):
+        """
+        初始化发件箱
+
+        消息以追加方式写入分段文件（prefix.1, prefix.2, ...），每段不超过
+        segment_size 字节；分段数超过 max_segments 时删除最旧的分段。
+        已补发到的位置保存在 prefix.pos 中，重启后从该位置继续。
+
+        Args:
+            prefix: 分段文件名前缀（位于当前目录）
+            segment_size: 单个分段的最大字节数，默认 4KB
+            max_segments: 最多保留的分段数，默认 4 个
+        """
+        self.prefix = prefix
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.dropped = 0  # 因空间不足被丢弃的分段数
+        self.damaged = 0  # 因记录损坏未能全部补发的分段数
+        self.segments = self._scan()
+        self.read_seq, self.read_pos = self._load_pos()
+        self._file = None
+        self._size = 0
+
+    def _name(self, seq):
+        """分段文件名"""
+        return "{}.{}".format(self.prefix, seq)
+
+    def _scan(self):
+        """查找已存在的分段，按序号排序"""
+        head = self.prefix + "."
+        seqs = []
+        for name in os.listdir():
+            if name.startswith(head) and name[len(head):].isdigit():
+                seqs.append(int(name[len(head):]))
+        seqs.sort()
+        return seqs
+
+    def _load_pos(self):
+        """读取补发位置"""
+        try:
+            with open(self.prefix + ".pos") as f:
+                seq, pos = f.read().split()
+                return int(seq), int(pos)
+        except (OSError, ValueError):
+            return (self.segments[0] if self.segments else 0), 0
+
+    def _save_pos(self):
+        """保存补发位置"""
+        with open(self.prefix + ".pos", "w") as f:
+            f.write("{} {}".format(self.read_seq, self.read_pos))
+
+    def _remove(self, seq):
+        """删除分段文件"""
+        if self._file and seq == self.segments[-1]:
+            self._file.close()
+            self._file = None
+        self.segments.remove(seq)
+        try:
+            os.remove(self._name(seq))
+        except OSError:
+            pass
+        if seq == self.read_seq:
+            self.read_seq = self.segments[0] if self.segments else 0
+            self.read_pos = 0
+
+    def _valid_size(self, name):
+        """分段开头完整记录的总字节数"""
+        pos = 0
+        with open(name, "rb") as f:
+            while self._read(f) is not None:
+                pos = f.tell()
+        return pos
+
+    def _open_tail(self, need):
+        """打开用于追加的分段，空间不足时新建分段并淘汰最旧的分段"""
+        if self._file is None and self.segments:
+            # 断电可能在最后一个分段末尾留下写了一半的记录，
+            # 在它后面追加的记录都无法读出，这时改为写入新分段
+            name = self._name(self.segments[-1])
+            self._size = os.stat(name)[6]
+            if self._valid_size(name) == self._size:
+                self._file = open(name, "ab")
+
+        if self._file is None or (self._size and self._size + need > self.segment_size):
+            if self._file:
+                self._file.close()
+            seq = self.segments[-1] + 1 if self.segments else 1
+            self.segments.append(seq)
+            self._file = open(self._name(seq), "wb")
+            self._size = 0
+
+            while len(self.segments) > self.max_segments:
+                self._remove(self.segments[0])
+                self.dropped += 1
+                self._save_pos()
+
+        return self._file
+
+    def put(self, topic, payload, qos=1, retain=False):
+        """
+        追加一条待发送消息
+
+        Args:
+            topic: 主题
+            payload: 消息内容（不超过 65535 字节）
+            qos: 补发时使用的 QoS，默认 1
+            retain: 是否为保留消息
+        """
+        if isinstance(topic, str):
+            topic = topic.encode()
+        if isinstance(payload, str):
+            payload = payload.encode()
+        assert len(payload) < 65536
+
+        size = _HEADER_SIZE + len(topic) + len(payload)
+        f = self._open_tail(size)
+        f.write(struct.pack(_HEADER, _MAGIC, qos | retain << 2, len(topic), len(payload)))
+        f.write(topic)
+        f.write(payload)
+        f.flush()
+        self._size += size
+
+    def _read(self, f):
+        """读取一条记录，遇到文件末尾或不完整的记录返回 None"""
+        header = f.read(_HEADER_SIZE)
+        if not header or len(header) < _HEADER_SIZE:
+            return None
+        magic, flags, topic_len, payload_len = struct.unpack(_HEADER, header)
+        if magic != _MAGIC:
+            return None
+        topic = f.read(topic_len)
+        payload = f.read(payload_len)
+        if len(topic) < topic_len or len(payload) < payload_len:
+            return None
+        return topic, payload, flags & 3, bool(flags & 4)
+
+    def pending(self):
+        """
+        是否有待补发的消息
+
+        Returns:
+            bool: 有待补发的消息返回 True
+        """
+        return bool(self.segments)
+
+    def drain(self, client, batch=32):
+        """
+        通过 MQTT 客户端补发全部消息（从最旧的开始）
+
+        每批最多 batch 条，通过 publish_many 连续发布（流水线数量由客户端的
+        max_inflight 决定），整批确认后才推进补发位置；中途断开时下次从该位置继续。
+        遇到损坏的记录时该分段之后的数据无法读出，分段被删除并计入 damaged。
+
+        Args:
+            client: 已连接的 MQTTClient
+            batch: 每批消息数，默认 32
+
+        Returns:
+            int: 补发的消息数
+        """
+        sent = 0
+        while self.segments:
+            seq = self.segments[0]
+            if self.read_seq != seq:
+                self.read_seq, self.read_pos = seq, 0
+
+            name = self._name(seq)
+            with open(name, "rb") as f:
+                f.seek(self.read_pos)
+                end = self.read_pos
+                done = False
+                while not done:
+                    records = []
+                    while len(records) < batch:
+                        record = self._read(f)
+                        if record is None:
+                            # 文件末尾或损坏的记录，之后的数据不再读取
+                            done = True
+                            break
+                        records.append(record)
+                        end = f.tell()
+                    if records:
+                        client.publish_many(records)
+                        self.read_pos = end
+                        self._save_pos()
+                        sent += len(records)
+
+            # 分段已全部发送（或余下的数据已损坏）
+            if self.read_pos < os.stat(name)[6]:
+                self.damaged += 1
+            self._remove(seq)
+            self._save_pos()
+
+        return sent
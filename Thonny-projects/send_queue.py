@@ -0,0 +1,127 @@
+"""
+优先级发送队列模块
+在 MQTTClient 前缓存待发送消息：高优先级消息先发，同一主题只保留最新的若干条
+"""
+
+# 优先级（数值越小越先发送）
+CRITICAL = 0
+NORMAL = 1
+BULK = 2
+
+# 保留策略
+KEEP_ALL = 0     # 保留全部消息
+KEEP_LATEST = 1  # 只保留最新一条（大于 1 的整数表示保留最新 N 条）
+
+
+class SendQueue:
+    """按优先级发送、按主题合并的内存发送队列"""
+
+    def __init__(self, max_messages=32, levels=3):
+        """
+        初始化发送队列
+
+        Args:
+            max_messages: 最多缓存的消息数，超出时丢弃最低优先级中最旧的消息，
+                          但不会为低优先级的新消息丢弃更高优先级的消息
+            levels: 优先级数量，默认 3 个（CRITICAL / NORMAL / BULK）
+        """
+        self.max_messages = max_messages
+        self.queues = [[] for _ in range(levels)]  # 每个优先级一个列表，元素为 (topic, payload, qos, retain)
+        self.policies = {}  # 主题 -> (keep, priority, qos, retain)
+        self.counts = {}    # 主题 -> 队列中的消息数
+        self.size = 0
+        self.coalesced = 0  # 被同主题新消息替换掉的消息数
+        self.dropped = 0    # 因队列已满被丢弃的消息数
+
+    def set_policy(self, topic, keep=KEEP_ALL, priority=NORMAL, qos=0, retain=False):
+        """
+        设置主题的保留策略和发送参数
+
+        Args:
+            topic: 主题
+            keep: KEEP_ALL 保留全部，KEEP_LATEST 只保留最新一条，N 保留最新 N 条
+            priority: 优先级，CRITICAL / NORMAL / BULK
+            qos: 发送时使用的 QoS
+            retain: 是否为保留消息
+        """
+        if isinstance(topic, str):
+            topic = topic.encode()
+        self.policies[topic] = (keep, priority, qos, retain)
+
+    def put(self, topic, payload):
+        """
+        加入一条待发送消息（按主题策略合并）
+
+        Args:
+            topic: 主题
+            payload: 消息内容
+        """
+        if isinstance(topic, str):
+            topic = topic.encode()
+        keep, priority, qos, retain = self.policies.get(topic, (KEEP_ALL, NORMAL, 0, False))
+
+        # 同主题消息超过保留条数时去掉最旧的一条
+        if keep and self.counts.get(topic, 0) >= keep:
+            self._remove_oldest(self.queues[priority], topic)
+            self.coalesced += 1
+
+        # 队列已满时丢弃不高于新消息优先级的最低一级中最旧的消息；
+        # 已缓存的消息都比新消息重要时丢弃新消息
+        if self.size >= self.max_messages:
+            for level in range(len(self.queues) - 1, priority - 1, -1):
+                queue = self.queues[level]
+                if queue:
+                    self._remove_oldest(queue, queue[0][0])
+                    self.dropped += 1
+                    break
+            else:
+                self.dropped += 1
+                return
+
+        self.queues[priority].append((topic, payload, qos, retain))
+        self.counts[topic] = self.counts.get(topic, 0) + 1
+        self.size += 1
+
+    def _remove_oldest(self, queue, topic):
+        """删除队列中该主题最旧的一条消息"""
+        for i in range(len(queue)):
+            if queue[i][0] == topic:
+                queue.pop(i)
+                self.counts[topic] -= 1
+                self.size -= 1
+                return
+
+    def pending(self):
+        """
+        是否有待发送的消息
+
+        Returns:
+            bool: 有待发送的消息返回 True
+        """
+        return self.size > 0
+
+    def flush(self, client, batch=16):
+        """
+        通过 MQTT 客户端发送全部消息，高优先级先发
+
+        每批最多 batch 条，通过 publish_many 连续发布，整批确认后才从队列中移除；
+        中途失败时未确认的消息留在队列中，下次重发。
+
+        Args:
+            client: 已连接的 MQTTClient
+            batch: 每批消息数，默认 16
+
+        Returns:
+            int: 发送的消息数
+        """
+        sent = 0
+        for queue in self.queues:
+            while queue:
+                records = queue[:batch]
+                client.publish_many(records)
+                del queue[:len(records)]
+                for record in records:
+                    self.counts[record[0]] -= 1
+                self.size -= len(records)
+                sent += len(records)
+        return sent
@@ -0,0 +1,247 @@
+import uasyncio as asyncio
+import utime as time
+from umqtt import simple
+
+
+class _Stream:
+    # Stands in for the socket, so the encoders and packet handlers of
+    # simple.MQTTClient can write synchronously. Output is queued here and
+    # handed to the asyncio stream by flush(), one task at a time.
+    def __init__(self, stream):
+        self.stream = stream
+        self.out = bytearray()
+        self.lock = asyncio.Lock()
+
+    def write(self, buf):
+        self.out += buf
+
+    async def flush(self):
+        async with self.lock:
+            while self.out:
+                out = self.out
+                self.out = bytearray()
+                self.stream.write(out)
+                await self.stream.drain()
+
+    def close(self):
+        self.stream.close()
+
+
+# An asyncio variant of simple.MQTTClient sharing its packet encoding and
+# parsing. connect(), publish(), subscribe() and disconnect() are
+# coroutines; once connected a background task reads and dispatches
+# incoming packets (wait_msg()/check_msg() are not used) and another one
+# retransmits unacknowledged publishes and runs the keepalive scheduler,
+# failing the connection when a PINGRESP does not arrive in time.
+class MQTTClient(simple.MQTTClient):
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self._stream = None
+        self._tasks = ()
+        self._evt = asyncio.Event()
+        self._subacks = {}
+        self._nacks = {}
+        self._err = None
+
+    # Wakes every coroutine waiting for an ack or for the connection to fail.
+    def _wake(self):
+        evt = self._evt
+        self._evt = asyncio.Event()
+        evt.set()
+
+    async def _progress(self):
+        if self._err is None:
+            await self._timed(self._evt.wait())
+        if self._err is not None:
+            raise self._err
+
+    # Awaits aw, failing with ETIMEDOUT after timeout_ms if that is set.
+    async def _timed(self, aw):
+        if not self.timeout_ms:
+            return await aw
+        try:
+            return await asyncio.wait_for(aw, self.timeout_ms / 1000)
+        except asyncio.TimeoutError:
+            raise OSError(110)  # ETIMEDOUT
+
+    def _fail(self, e):
+        self.healthy = False
+        if self._err is None:
+            self._err = e
+            self._stream.close()
+        self._wake()
+
+    async def _aread_pkt(self):
+        while 1:
+            op = self._parse()
+            if op is not None:
+                return op
+            n = await self._reader.readinto(self._rroom())
+            if n == 0:
+                raise OSError(-1)
+            if n:
+                self._got(n)
+
+    async def _read_loop(self):
+        try:
+            while 1:
+                op = await self._aread_pkt()
+                if op == 0x90:
+                    i = self._skip_props(self._bs + 2)
+                    self._subacks[self._rpid()] = bytes(self._rmv[i : self._be])
+                else:
+                    self._handle(op)
+                await self.sock.flush()
+                self._wake()
+        except Exception as e:
+            self._fail(e)
+
+    async def _keepalive_loop(self):
+        try:
+            while self._err is None:
+                wait = self._retry()
+                self._keepalive()
+                if not self.healthy:
+                    raise OSError(110)  # ETIMEDOUT
+                ka = self._ka_wait()
+                if 0 <= ka < wait:
+                    wait = ka
+                await self.sock.flush()
+                await asyncio.sleep(wait / 1000)
+        except Exception as e:
+            self._fail(e)
+
+    # Rejected publishes are reported by the coroutine that sent them.
+    def _nack(self, pid, rc):
+        self._nacks[pid] = rc
+
+    def _check_nack(self, pid):
+        rc = self._nacks.pop(pid, 0)
+        if rc:
+            raise simple.MQTTException(rc)
+
+    def isconnected(self):
+        return self._stream is not None and self._err is None
+
+    def _stop_tasks(self):
+        for t in self._tasks:
+            t.cancel()
+        self._tasks = ()
+
+    async def connect(self, clean_session=True):
+        # Reconnecting; the previous connection's tasks would otherwise
+        # keep running next to the new ones.
+        self._stop_tasks()
+        if self._stream is not None:
+            self._stream.close()
+        if self.ssl:
+            conn = asyncio.open_connection(self.server, self.port, ssl=self.ssl)
+        else:
+            conn = asyncio.open_connection(self.server, self.port)
+        r, w = await self._timed(conn)
+        self._reader = r
+        self._stream = w
+        self.sock = _Stream(w)
+        self._err = None
+        self._rreset()
+        self._ping_t = None
+        self._last_rx = time.ticks_ms()
+        self.healthy = True
+        try:
+            self._write(self._connect_pkt(clean_session))
+            await self.sock.flush()
+            sp = self._connack(await self._timed(self._aread_pkt()))
+            await self.sock.flush()
+        except Exception as e:
+            self._fail(e)
+            raise
+        self._tasks = (
+            asyncio.create_task(self._read_loop()),
+            asyncio.create_task(self._keepalive_loop()),
+        )
+        return sp
+
+    async def disconnect(self):
+        self._stop_tasks()
+        self.healthy = False
+        try:
+            if self._err is None:
+                self._write(b"\xe0\0")
+                await self.sock.flush()
+        finally:
+            self._stream.close()
+            await self._stream.wait_closed()
+
+    async def ping(self):
+        super().ping()
+        await self.sock.flush()
+
+    # Completes once the message has been written (QoS 0) or acknowledged
+    # (QoS 1/2). Concurrent publishes are pipelined up to max_inflight.
+    async def publish(self, topic, msg, retain=False, qos=0):
+        while qos and self._nifl >= self._window:
+            await self._progress()
+        if self._err is not None:
+            raise self._err
+        pid = self._publish(topic, msg, retain, qos)
+        await self.sock.flush()
+        while qos and self._ifl_find(pid) >= 0:
+            await self._progress()
+        self._check_nack(pid)
+
+    # Same as simple.MQTTClient.publish_many(); the batch is flushed before
+    # waiting for room in the in-flight window.
+    async def publish_many(self, msgs):
+        i = 0
+        for topic, msg, qos, retain in msgs:
+            if self._err is not None:
+                raise self._err
+            if qos > 0 and self._nifl >= self._window:
+                if i:
+                    self._write(self._wmv[:i])
+                    i = 0
+                await self.sock.flush()
+                while self._nifl > self._window // 2:
+                    await self._progress()
+            i = self._batch_add(i, topic, msg, qos, retain)
+        if i:
+            self._write(self._wmv[:i])
+        await self.sock.flush()
+        await self.wait_acks()
+        if self._nacks:
+            rc = self._nacks.popitem()[1]
+            self._nacks.clear()
+            raise simple.MQTTException(rc)
+
+    # Same as simple.MQTTClient.publish_stream(). The stream is held for the
+    # whole frame, so acks and pings queued meanwhile go out after it.
+    async def publish_stream(self, topic, size, src, retain=False, qos=0):
+        while qos and self._nifl >= self._window:
+            await self._progress()
+        if self._err is not None:
+            raise self._err
+        pid = self._next_pid() if qos > 0 else 0
+        async with self.sock.lock:
+            w = self._stream
+            if self.sock.out:
+                w.write(self.sock.out)
+                self.sock.out = bytearray()
+            for b in self._stream_frame(topic, size, src, retain, qos, pid):
+                w.write(b)
+                self._sent(len(b))
+                await w.drain()
+        while qos and self._ifl_find(pid) >= 0:
+            await self._progress()
+        self._check_nack(pid)
+
+    async def wait_acks(self):
+        while self._nifl:
+            await self._progress()
+
+    async def subscribe(self, topic, qos=0):
+        assert self.cb or self._scb or self._rcache is not None, "Subscribe callback is not set"
+        pid = self._subscribe(topic, qos)
+        await self.sock.flush()
+        while pid not in self._subacks:
+            await self._progress()
+        return self._suback(topic, self._subacks.pop(pid))
@@ -0,0 +1,41 @@
+# Payload compression for MQTTClient.set_compression(). A compressed
+# payload is MARKER followed by a zlib stream. 0xFF never starts UTF-8
+# text, so JSON and other text payloads cannot be mistaken for one;
+# binary payloads starting with MARKER must not be sent uncompressed to
+# a receiver that inflates.
+#
+# Uses the deflate module of MicroPython 1.21+, or zlib on older
+# firmware (decompression only) and on CPython.
+
+try:
+    import deflate
+    import io
+except ImportError:
+    deflate = None
+    import zlib
+
+MARKER = b"\xffZ"
+
+
+def pack(data):
+    if deflate:
+        f = io.BytesIO()
+        with deflate.DeflateIO(f, deflate.ZLIB) as d:
+            d.write(data)
+        return MARKER + f.getvalue()
+    return MARKER + zlib.compress(data)
+
+
+def unpack(data):
+    if deflate:
+        return deflate.DeflateIO(io.BytesIO(data[2:]), deflate.ZLIB).read()
+    return zlib.decompress(data[2:])
+
+
+def can_pack():
+    try:
+        pack(b"")
+        return True
+    except (AttributeError, OSError, ValueError):
+        # Firmware built without compression support.
+        return False
@@ -0,0 +1,119 @@
+# Spreads an MQTTClient over several brokers. Every endpoint is scored by
+# its recent connect latency and failures, and connect() tries them best
+# first, so when the broker in use goes away the client reconnects to
+# the healthiest other one instead of retrying the dead one. With
+# keepalive set, a dead broker is noticed within one keepalive period;
+# with timeout_ms set, each failed attempt costs at most that long.
+#
+#   pool = BrokerPool([("192.168.1.157", 1883), ("192.168.31.11", 1883)])
+#   client = MQTTClient(client_id, "", keepalive=60, timeout_ms=5000)
+#   pool.connect(client)
+#
+# Calling connect() again while connected through the pool means the
+# connection was lost, and counts as a failure of its broker.
+
+import utime as time
+from umqtt.simple import MQTTException
+
+# Endpoint fields: host, port, smoothed connect latency in ms (-1 until
+# measured), failure count, ticks of the last failure, connects.
+_HOST = 0
+_PORT = 1
+_LAT = 2
+_FAILS = 3
+_FAIL_T = 4
+_CONNS = 5
+
+
+class BrokerPool:
+    # brokers are (host, port) pairs or host names using the client's
+    # default port. Each failure adds fail_ms to an endpoint's score, and
+    # the penalty halves every decay_ms. Endpoints not tried yet are
+    # assumed to connect in guess_ms; ties keep the order given.
+    def __init__(self, brokers, fail_ms=10000, decay_ms=60000, guess_ms=1000):
+        assert brokers
+        self.endpoints = []
+        for b in brokers:
+            host, port = (b, 0) if isinstance(b, str) else b
+            self.endpoints.append([host, port, -1, 0, 0, 0])
+        self.fail_ms = fail_ms
+        self.decay_ms = decay_ms
+        self.guess_ms = guess_ms
+        self.current = None
+
+    def score(self, e):
+        s = self.guess_ms if e[_LAT] < 0 else e[_LAT]
+        if e[_FAILS]:
+            age = time.ticks_diff(time.ticks_ms(), e[_FAIL_T])
+            halvings = age // self.decay_ms if age > 0 else 0
+            if halvings < 16:
+                s += (self.fail_ms * e[_FAILS]) >> halvings
+        return s
+
+    # Endpoints in the order connect() tries them.
+    def ranked(self):
+        scored = [(self.score(e), i) for i, e in enumerate(self.endpoints)]
+        scored.sort()
+        return [self.endpoints[i] for _, i in scored]
+
+    def _target(self, client, e):
+        client.server = e[_HOST]
+        client.port = e[_PORT] or (8883 if client.ssl else 1883)
+
+    def _lost(self):
+        if self.current is not None:
+            self._failed(self.current)
+            self.current = None
+
+    def _failed(self, e):
+        e[_FAILS] += 1
+        e[_FAIL_T] = time.ticks_ms()
+
+    def _connected(self, e, t):
+        ms = time.ticks_diff(time.ticks_ms(), t)
+        e[_LAT] = ms if e[_LAT] < 0 else e[_LAT] + (ms - e[_LAT]) // 4
+        e[_FAILS] //= 2
+        e[_CONNS] += 1
+        self.current = e
+
+    # Connects client to the best broker that accepts it and returns the
+    # session present flag. Raises the last error if every one fails.
+    def connect(self, client, clean_session=True):
+        self._lost()
+        err = None
+        for e in self.ranked():
+            self._target(client, e)
+            t = time.ticks_ms()
+            try:
+                sp = client.connect(clean_session)
+            except (OSError, MQTTException) as ex:
+                self._failed(e)
+                err = ex
+                continue
+            self._connected(e, t)
+            return sp
+        raise err
+
+    # Same as connect(), for the asyncio client.
+    async def aconnect(self, client, clean_session=True):
+        self._lost()
+        err = None
+        for e in self.ranked():
+            self._target(client, e)
+            t = time.ticks_ms()
+            try:
+                sp = await client.connect(clean_session)
+            except (OSError, MQTTException) as ex:
+                self._failed(e)
+                err = ex
+                continue
+            self._connected(e, t)
+            return sp
+        raise err
+
+    # (host, port, score, connects, failures) of every endpoint, for logs.
+    def status(self):
+        return [
+            (e[_HOST], e[_PORT], self.score(e), e[_CONNS], e[_FAILS])
+            for e in self.endpoints
+        ]
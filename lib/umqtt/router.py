@@ -0,0 +1,94 @@
+# Routes incoming messages to callbacks registered per topic filter.
+# Filters are stored in a trie keyed on topic levels, so dispatch walks
+# one branch per level (plus "+" and "#" branches) instead of comparing
+# the topic against every filter. A Router is passed to
+# MQTTClient.set_callback() and its filters can be subscribed in one go:
+#
+#   r = Router()
+#   r.add("sensor/+/data", on_data)
+#   r.add("config/#", on_config, qos=1)
+#   client.set_callback(r)
+#   client.connect()
+#   client.subscribe(r.filters())
+
+
+class Router:
+    def __init__(self, default=None):
+        # Each node is a dict of child nodes keyed by level; the None key
+        # holds the callbacks of a filter ending at that node.
+        self._root = {}
+        self._qos = {}
+        # Called for messages no filter matches.
+        self.default = default
+
+    def add(self, topic_filter, cb, qos=0):
+        if isinstance(topic_filter, str):
+            topic_filter = topic_filter.encode()
+        node = self._root
+        for level in topic_filter.split(b"/"):
+            child = node.get(level)
+            if child is None:
+                child = node[level] = {}
+            node = child
+        node.setdefault(None, []).append(cb)
+        self._qos[topic_filter] = max(qos, self._qos.get(topic_filter, 0))
+
+    # Removes one callback from a filter, or all of them if cb is None.
+    def remove(self, topic_filter, cb=None):
+        if isinstance(topic_filter, str):
+            topic_filter = topic_filter.encode()
+        path = [self._root]
+        levels = topic_filter.split(b"/")
+        for level in levels:
+            node = path[-1].get(level)
+            if node is None:
+                return
+            path.append(node)
+        cbs = path[-1].get(None)
+        if cbs and cb is not None and cb in cbs:
+            cbs.remove(cb)
+        if not cbs or cb is None:
+            path[-1].pop(None, None)
+            self._qos.pop(topic_filter, None)
+        # Prune nodes left without filters or children.
+        for i in range(len(levels), 0, -1):
+            if path[i]:
+                break
+            del path[i - 1][levels[i - 1]]
+
+    # (filter, qos) pairs for MQTTClient.subscribe().
+    def filters(self):
+        return list(self._qos.items())
+
+    def _match(self, node, levels, i, out):
+        # Wildcards do not match topics starting with "$" (e.g. $SYS).
+        wild = i or not levels[0].startswith(b"$")
+        if wild:
+            h = node.get(b"#")
+            if h is not None and None in h:
+                out.extend(h[None])
+        if i == len(levels):
+            if None in node:
+                out.extend(node[None])
+            return
+        child = node.get(levels[i])
+        if child is not None:
+            self._match(child, levels, i + 1, out)
+        if wild:
+            child = node.get(b"+")
+            if child is not None:
+                self._match(child, levels, i + 1, out)
+
+    def match(self, topic):
+        if isinstance(topic, str):
+            topic = topic.encode()
+        out = []
+        self._match(self._root, topic.split(b"/"), 0, out)
+        return out
+
+    def __call__(self, topic, msg):
+        cbs = self.match(topic)
+        if not cbs and self.default:
+            self.default(topic, msg)
+        for cb in cbs:
+            cb(topic, msg)
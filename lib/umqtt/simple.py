@@ -1,6 +1,54 @@
 import usocket as socket
 import ustruct as struct
+import uselect as select
+import utime as time
+from uarray import array
 from ubinascii import hexlify
+from micropython import const
+
+# Incoming QoS 2 packet ids remembered between PUBLISH and PUBREL.
+_QOS2_RX = const(16)
+# publish_many() writes batches of up to one TCP segment's worth of frames.
+_BATCH_MAX = const(1460)
+# Size of the packet buffer used to pass streamed payloads through.
+_CHUNK = const(512)
+# MQTT 5 property ids by value size; the rest are strings, binary data,
+# a string pair (0x26) or a variable byte integer (0x0B).
+_PROP1 = b"\x01\x17\x19\x24\x25\x28\x29\x2a"
+_PROP2 = b"\x13\x21\x22\x23"
+_PROP4 = b"\x02\x11\x18\x27"
+# Transfer metrics; set to 0 to compile the bookkeeping out.
+_METRICS = const(1)
+# Indices into MQTTClient._m.
+_M_TX = const(0)  # bytes written
+_M_RX = const(1)  # bytes read
+_M_PUB = const(2)  # PUBLISH packets sent, retransmissions excluded
+_M_RETRY = const(3)  # retransmissions
+_M_CONN = const(4)  # successful connects
+_M_WUS = const(5)  # time spent in sock.write, us
+_M_ACK = const(6)  # first ack latency bucket
+# Upper bounds in ms of the ack latency buckets; the last bucket holds
+# everything slower.
+_ACK_MS = (10, 25, 50, 100, 250, 500, 1000, 2500)
+# Bytes charged per retained cache entry on top of its topic and payload,
+# roughly what the dict slot, tuple and bytes headers take.
+_RC_ENTRY = const(48)
+# How long a resolved broker address is reused before looking it up again.
+DNS_TTL = 300000
+
+# Resolved broker addresses, shared by all clients:
+# (server, port) -> (sockaddr, expiry ticks).
+_dns = {}
+
+
+def _resolve(server, port):
+    now = time.ticks_ms()
+    e = _dns.get((server, port))
+    if e and time.ticks_diff(e[1], now) > 0:
+        return e[0]
+    addr = socket.getaddrinfo(server, port)[0][-1]
+    _dns[(server, port)] = (addr, time.ticks_add(now, DNS_TTL))
+    return addr
 
 
 class MQTTException(Exception):
@@ -17,6 +65,10 @@ class MQTTClient:
         password=None,
         keepalive=0,
         ssl=None,
+        max_inflight=1,
+        retry_ms=5000,
+        version=4,
+        timeout_ms=0,
     ):
         if port == 0:
             port = 8883 if ssl else 1883
@@ -30,28 +82,759 @@ class MQTTClient:
         self.user = user
         self.pswd = password
         self.keepalive = keepalive
+        # Longest a blocking operation waits without hearing from the broker
+        # before failing with ETIMEDOUT; 0 waits forever.
+        self.timeout_ms = timeout_ms
+        # Protocol level: 4 is MQTT 3.1.1, 5 is MQTT 5.
+        assert version in (4, 5)
+        self.version = version
         self.lw_topic = None
         self.lw_msg = None
         self.lw_qos = 0
         self.lw_retain = False
+        # Outgoing packets are assembled here and sent with a single write;
+        # the buffer grows to the largest frame seen and is then reused.
+        self._wbuf = bytearray(128)
+        self._wmv = memoryview(self._wbuf)
+        # Incoming data is read in chunks into _rbuf; bytes in [_rpos, _rend)
+        # are not parsed yet. _op is None while waiting for a fixed header,
+        # otherwise it holds the type of the packet whose _sz byte body is
+        # still arriving. Complete bodies are exposed as [_bs, _be).
+        self._rbuf = bytearray(128)
+        self._rmv = memoryview(self._rbuf)
+        self._rpos = 0
+        self._rend = 0
+        self._op = None
+        self._sz = 0
+        self._bs = 0
+        self._be = 0
+        self._poll = None
+        # Streaming delivery: PUBLISH packets longer than _schunk bytes are
+        # passed to _scb in pieces as they arrive. _stopic is the topic of
+        # the one being streamed (None if none), _spid its packet id, _soff
+        # and _stotal the payload offset and length, _sskip set when it is
+        # a QoS 2 resend whose payload was already delivered.
+        self._scb = None
+        self._schunk = 0
+        self._stopic = None
+        self._spid = 0
+        self._soff = 0
+        self._stotal = 0
+        self._sskip = False
+        self._sneed = 0
+        # QoS 1/2 publishes awaiting their acks: packet id (0 = free slot),
+        # time of the last send and the frame to retransmit. For QoS 2 the
+        # PUBLISH frame is replaced by a PUBREL once PUBREC arrives.
+        assert 0 < max_inflight < 65536
+        self.max_inflight = max_inflight
+        self.retry_ms = retry_ms
+        self._ifl_pid = array("H", bytes(2 * max_inflight))
+        self._ifl_t = array("i", bytes(4 * max_inflight))
+        self._ifl_pkt = [None] * max_inflight
+        self._nifl = 0
+        # Publishes allowed in flight: max_inflight, or less if an MQTT 5
+        # broker's Receive Maximum says so.
+        self._window = max_inflight
+        # Ids of incoming QoS 2 messages delivered but not yet released.
+        # When every slot is taken the oldest entries are overwritten.
+        self._rx_pid = array("H", bytes(2 * _QOS2_RX))
+        self._rx_next = 0
+        self._ack = bytearray(4)
+        # Keepalive bookkeeping: ticks of the last packet sent and of the
+        # last data received, and of the PINGREQ awaiting its PINGRESP.
+        self._last_tx = 0
+        self._last_rx = 0
+        self._ping_t = None
+        self.healthy = False
+        # Keepalive period in use; an MQTT 5 broker may override ours.
+        self._ka = keepalive
+        # MQTT 5 topic aliases of this connection: topic -> alias, and the
+        # number of aliases the broker accepts.
+        self._aliases = {}
+        self._alias_max = 0
+        # Encoded CONNECT packet and the settings it was built from.
+        self._conn_pkt = None
+        self._conn_key = None
+        # umqtt.compress once set_compression() is called, and the size
+        # from which publishes are compressed (0: never).
+        self._z = None
+        self._zmin = 0
+        # Retained message cache once set_retained_cache() is called:
+        # topic -> (payload, update number), the bytes charged for it and
+        # its budget.
+        self._rcache = None
+        self._rc_bytes = 0
+        self._rc_max = 0
+        self._rc_seq = 0
+        # Counters indexed by _M_*, followed by the ack latency histogram.
+        if _METRICS:
+            self._m = array("I", bytes(4 * (_M_ACK + len(_ACK_MS) + 1)))
+
+    def _write(self, buf):
+        if _METRICS:
+            t = time.ticks_us()
+            self.sock.write(buf)
+            self._m[_M_WUS] += time.ticks_diff(time.ticks_us(), t)
+        else:
+            self.sock.write(buf)
+        self._sent(len(buf))
+
+    # Accounts for n bytes written to the socket.
+    def _sent(self, n):
+        self._last_tx = time.ticks_ms()
+        if _METRICS:
+            self._m[_M_TX] += n
+
+    # Accounts for n bytes read into the receive buffer.
+    def _got(self, n):
+        self._rend += n
+        self._last_rx = time.ticks_ms()
+        if _METRICS:
+            self._m[_M_RX] += n
+
+    # Returns a snapshot of the transfer metrics: bytes written and read,
+    # publishes sent, retransmissions, successful connects, time blocked
+    # in sock.write (us) and a histogram of the time from sending a QoS 1/2
+    # publish (or, for QoS 2, its PUBREL) to its ack, counted in buckets
+    # bounded by ack_ms.
+    def metrics(self):
+        if not _METRICS:
+            return {}
+        m = self._m
+        return {
+            "tx_bytes": m[_M_TX],
+            "rx_bytes": m[_M_RX],
+            "published": m[_M_PUB],
+            "retries": m[_M_RETRY],
+            "connects": m[_M_CONN],
+            "write_us": m[_M_WUS],
+            "ack_ms": _ACK_MS,
+            "ack_hist": list(m[_M_ACK:]),
+        }
+
+    def reset_metrics(self):
+        if _METRICS:
+            for i in range(len(self._m)):
+                self._m[i] = 0
+
+    def _ack_time(self, i):
+        ms = time.ticks_diff(time.ticks_ms(), self._ifl_t[i])
+        b = 0
+        while b < len(_ACK_MS) and ms > _ACK_MS[b]:
+            b += 1
+        self._m[_M_ACK + b] += 1
+
+    # Returns a packet buffer of at least n bytes; the first keep bytes
+    # survive if it has to grow.
+    def _wbuf_for(self, n, keep=0):
+        if len(self._wbuf) < n:
+            buf = bytearray(n)
+            buf[:keep] = self._wmv[:keep]
+            self._wbuf = buf
+            self._wmv = memoryview(buf)
+        return self._wbuf
+
+    def _next_pid(self):
+        self.pid = self.pid % 65535 + 1
+        while self._nifl and self._ifl_find(self.pid) >= 0:
+            self.pid = self.pid % 65535 + 1
+        return self.pid
+
+    def _put_len(self, buf, i, sz):
+        while sz > 0x7F:
+            buf[i] = (sz & 0x7F) | 0x80
+            sz >>= 7
+            i += 1
+        buf[i] = sz
+        return i + 1
+
+    def _put_str(self, buf, i, s):
+        if isinstance(s, str):
+            s = s.encode()
+        n = len(s)
+        buf[i] = n >> 8
+        buf[i + 1] = n & 0xFF
+        buf[i + 2 : i + 2 + n] = s
+        return i + 2 + n
+
+    def _put_publish(self, buf, i, topic, msg, retain, qos, pid, alias=0):
+        i = self._put_publish_hdr(buf, i, topic, len(msg), retain, qos, pid, alias)
+        n = len(msg)
+        buf[i : i + n] = msg
+        return i + n
+
+    # Encodes a PUBLISH up to its payload of size bytes. With MQTT 5 a
+    # non-zero alias is sent as a Topic Alias property.
+    def _put_publish_hdr(self, buf, i, topic, size, retain, qos, pid, alias=0):
+        sz = 2 + len(topic) + size
+        if qos > 0:
+            sz += 2
+        if self.version == 5:
+            sz += 4 if alias else 1
+        assert sz < 2097152
+        buf[i] = 0x30 | qos << 1 | retain
+        i = self._put_len(buf, i + 1, sz)
+        i = self._put_str(buf, i, topic)
+        if qos > 0:
+            buf[i] = pid >> 8
+            buf[i + 1] = pid & 0xFF
+            i += 2
+        if self.version == 5:
+            if alias:
+                buf[i : i + 2] = b"\x03\x23"
+                buf[i + 2] = alias >> 8
+                buf[i + 3] = alias & 0xFF
+                i += 4
+            else:
+                buf[i] = 0
+                i += 1
+        return i
 
-    def _send_str(self, s):
-        self.sock.write(struct.pack("!H", len(s)))
-        self.sock.write(s)
+    # Returns the topic and alias to send for an MQTT 5 publish. The first
+    # publish to a topic maps it to a free alias, later ones send just the
+    # alias; once the broker's limit is reached new topics go without.
+    def _alias(self, topic):
+        a = self._aliases.get(topic)
+        if a:
+            return b"", a
+        a = len(self._aliases) + 1
+        if a > self._alias_max:
+            return topic, 0
+        self._aliases[topic] = a
+        return topic, a
+
+    def _put_connect(self, clean_session):
+        strs = [self.client_id]
+        flags = clean_session << 1
+        if self.lw_topic:
+            strs += (self.lw_topic, self.lw_msg)
+            flags |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
+            flags |= self.lw_retain << 5
+        if self.user:
+            strs += (self.user, self.pswd)
+            flags |= 0xC0
+        for j in range(len(strs)):
+            if isinstance(strs[j], str):
+                strs[j] = strs[j].encode()
+        sz = 10
+        for s in strs:
+            sz += 2 + len(s)
+        if self.version == 5:
+            # Receive Maximum property, and empty will properties.
+            sz += 4
+            if self.lw_topic:
+                sz += 1
+        assert self.keepalive < 65536
+        buf = self._wbuf_for(sz + 5)
+        buf[0] = 0x10
+        i = self._put_len(buf, 1, sz)
+        buf[i : i + 6] = b"\0\x04MQTT"
+        buf[i + 6] = self.version
+        buf[i + 7] = flags
+        buf[i + 8] = self.keepalive >> 8
+        buf[i + 9] = self.keepalive & 0x00FF
+        i += 10
+        if self.version == 5:
+            # The broker may have as many QoS 1/2 messages outstanding as
+            # incoming QoS 2 ids are remembered.
+            buf[i : i + 4] = b"\x03\x21\0\0"
+            buf[i + 3] = _QOS2_RX
+            i += 4
+        for j in range(len(strs)):
+            if j == 1 and self.version == 5 and self.lw_topic:
+                buf[i] = 0
+                i += 1
+            i = self._put_str(buf, i, strs[j])
+        return i
+
+    # Returns the CONNECT packet, encoding it again only when the client id,
+    # credentials, keepalive or will have changed since the last connect.
+    def _connect_pkt(self, clean_session):
+        key = (
+            self.client_id,
+            self.user,
+            self.pswd,
+            self.keepalive,
+            self.lw_topic,
+            self.lw_msg,
+            self.lw_qos,
+            self.lw_retain,
+            clean_session,
+            self.version,
+        )
+        if key != self._conn_key:
+            n = self._put_connect(clean_session)
+            # print(hex(n), hexlify(self._wmv[:n], ":"))
+            self._conn_pkt = bytes(self._wmv[:n])
+            self._conn_key = key
+        return self._conn_pkt
+
+    # Checks the CONNACK left in the receive buffer and returns the
+    # session present flag.
+    def _connack(self, op):
+        assert op == 0x20 and self._be - self._bs >= 2
+        resp = self._rbuf[self._bs + 1]
+        if resp != 0:
+            raise MQTTException(resp)
+        if _METRICS:
+            self._m[_M_CONN] += 1
+        self._window = self.max_inflight
+        self._ka = self.keepalive
+        self._aliases = {}
+        self._alias_max = 0
+        if self.version == 5:
+            self._connack_props()
+        # Publishes left unacknowledged by a previous connection are resent,
+        # except streamed ones which have no stored frame.
+        for i in range(len(self._ifl_t)):
+            if self._ifl_pid[i] and self._ifl_pkt[i] is None:
+                self._ifl_ack(self._ifl_pid[i])
+            self._ifl_t[i] = time.ticks_add(self._ifl_t[i], -self.retry_ms)
+        self._retry()
+        sp = self._rbuf[self._bs] & 1
+        if not sp:
+            # A new session numbers the broker's packet ids afresh, so ids of
+            # QoS 2 messages not released before the link dropped are stale.
+            for i in range(_QOS2_RX):
+                self._rx_pid[i] = 0
+            self._rx_next = 0
+        return sp
+
+    # Applies the CONNACK properties that limit what this client may send.
+    def _connack_props(self):
+        buf = self._rbuf
+        n, i = self._get_len(self._bs + 2)
+        end = i + n
+        while i < end:
+            p = buf[i]
+            i += 1
+            if p == 0x13:  # Server Keep Alive
+                self._ka = buf[i] << 8 | buf[i + 1]
+            elif p == 0x21:  # Receive Maximum
+                self._window = min(self.max_inflight, buf[i] << 8 | buf[i + 1])
+            elif p == 0x22:  # Topic Alias Maximum
+                self._alias_max = buf[i] << 8 | buf[i + 1]
+            i += self._prop_size(p, i)
 
-    def _recv_len(self):
-        n = 0
-        sh = 0
+    # Decodes the variable byte integer at i of the receive buffer.
+    # Returns it and the index after it.
+    def _get_len(self, i):
+        n = sh = 0
         while 1:
-            b = self.sock.read(1)[0]
+            b = self._rbuf[i]
+            i += 1
             n |= (b & 0x7F) << sh
             if not b & 0x80:
-                return n
+                return n, i
             sh += 7
 
+    # Returns the size of the value of property p, which starts at i.
+    def _prop_size(self, p, i):
+        if p in _PROP1:
+            return 1
+        if p in _PROP2:
+            return 2
+        if p in _PROP4:
+            return 4
+        if p == 0x0B:
+            return self._get_len(i)[1] - i
+        buf = self._rbuf
+        n = 2 + (buf[i] << 8 | buf[i + 1])
+        if p == 0x26:
+            n += 2 + (buf[i + n] << 8 | buf[i + n + 1])
+        return n
+
+    # Returns the index past the properties at i (i itself for MQTT 3.1.1).
+    def _skip_props(self, i):
+        if self.version < 5:
+            return i
+        n, i = self._get_len(i)
+        return i + n
+
+    def _rreset(self):
+        self._rpos = self._rend = 0
+        self._op = None
+        self._stopic = None
+
+    # Makes room for the rest of the current frame and returns the free
+    # tail of the receive buffer.
+    def _rroom(self):
+        i = self._rpos
+        end = self._rend
+        if i == end:
+            i = end = self._rpos = self._rend = 0
+        # Room needed for the rest of the current frame, or for a fixed header.
+        if self._op is None:
+            need = 5
+        elif self._streamed():
+            # The rest of the variable header, or the next chunk.
+            need = self._sneed - (end - i)
+        else:
+            need = self._sz - (end - i)
+        if len(self._rbuf) - end < need:
+            if len(self._rbuf) < end - i + need:
+                buf = bytearray(end - i + need)
+            else:
+                buf = self._rbuf
+            buf[: end - i] = self._rmv[i:end]
+            self._rbuf = buf
+            self._rmv = memoryview(buf)
+            self._rpos = 0
+            self._rend = end = end - i
+        return self._rmv[end:]
+
+    # Reads what is available into the receive buffer, first waiting up
+    # to wait ms (-1: without limit) for data to arrive. Returns False if
+    # there was nothing to read.
+    def _fill(self, wait):
+        mv = self._rroom()
+        if wait:
+            self._poll.poll(wait)
+        self.sock.setblocking(False)
+        try:
+            n = self.sock.readinto(mv)
+        finally:
+            self.sock.setblocking(True)
+        if n is None:
+            return False
+        if n == 0:
+            raise OSError(-1)
+        self._got(n)
+        return True
+
+    # Advances the parser over buffered data. Returns the type of the next
+    # complete packet, or None if more data is needed.
+    def _parse(self):
+        buf = self._rbuf
+        i = self._rpos
+        end = self._rend
+        if self._op is None:
+            j = i + 1
+            sz = 0
+            sh = 0
+            while 1:
+                if j >= end:
+                    return None
+                b = buf[j]
+                j += 1
+                sz |= (b & 0x7F) << sh
+                if not b & 0x80:
+                    break
+                sh += 7
+            self._op = buf[i]
+            self._sz = sz
+            self._rpos = i = j
+        if self._streamed():
+            if not self._stream_chunks():
+                return None
+            i = self._rpos
+        elif end - i < self._sz:
+            return None
+        op = self._op
+        self._op = None
+        self._bs = i
+        self._be = self._rpos = i + self._sz
+        return op
+
+    def _streamed(self):
+        return self._stopic is not None or (
+            self._scb is not None and self._op & 0xF0 == 0x30 and self._sz > self._schunk
+        )
+
+    # Passes buffered payload of a streamed PUBLISH to the stream callback,
+    # in chunks of _schunk bytes (the last one may be shorter). Returns
+    # True once the whole payload has been consumed; the packet is then
+    # reported with an empty body.
+    def _stream_chunks(self):
+        buf = self._rbuf
+        i = self._rpos
+        end = self._rend
+        if self._stopic is None:
+            n = self._pub_hdr(self._op, i, end)
+            if end - i < n:
+                self._sneed = n
+                return False
+            tl = buf[i] << 8 | buf[i + 1]
+            self._stopic = bytes(buf[i + 2 : i + 2 + tl])
+            self._spid = 0
+            if self._op & 6:
+                self._spid = buf[i + 2 + tl] << 8 | buf[i + 3 + tl]
+            self._sskip = self._op & 6 == 4 and not self._rx_new(self._spid)
+            self._soff = 0
+            self._stotal = self._sz - n
+            self._sz -= n
+            i += n
+        while self._sz and end - i >= min(self._sz, self._schunk):
+            n = min(self._sz, self._schunk)
+            if not self._sskip:
+                self._scb(self._stopic, self._rmv[i : i + n], self._soff, self._stotal)
+            self._soff += n
+            self._sz -= n
+            i += n
+        self._rpos = i
+        self._sneed = min(self._sz, self._schunk)
+        return not self._sz
+
+    # Returns the length of the variable header of the PUBLISH at i, or,
+    # if it does not fit before end, more than end - i.
+    def _pub_hdr(self, op, i, end):
+        buf = self._rbuf
+        if end - i < 2:
+            return 2
+        n = 2 + (buf[i] << 8 | buf[i + 1])
+        if op & 6:
+            n += 2
+        if self.version == 5:
+            # Properties, preceded by their length.
+            j = i + n
+            sh = plen = 0
+            n += 1
+            while j < end:
+                b = buf[j]
+                j += 1
+                plen |= (b & 0x7F) << sh
+                if not b & 0x80:
+                    return n + plen
+                sh += 7
+                n += 1
+        return n
+
+    # Returns the type of the next complete packet. If none is buffered
+    # and block is False, returns None after reading what is available.
+    # A blocking read started at ticks since is an operation waiting for
+    # a reply and subject to timeout_ms; without since, only the rest of
+    # a partly received packet is.
+    def _read_pkt(self, block, since=None):
+        while 1:
+            op = self._parse()
+            if op is not None:
+                return op
+            self._keepalive()
+            if not block:
+                if not self._fill(0):
+                    return None
+            elif not self.healthy:
+                raise OSError(110)  # ETIMEDOUT
+            else:
+                self._fill(self._wait_ms(since))
+
+    # Returns how long to wait for data: until the next keepalive action
+    # or until timeout_ms have passed since since or the last data
+    # received, whichever is later. Raises ETIMEDOUT if that has passed.
+    def _wait_ms(self, since):
+        wait = self._ka_wait()
+        if not self.timeout_ms:
+            return wait
+        if since is None:
+            if self._op is None and self._rpos == self._rend:
+                return wait
+            since = self._last_rx
+        elif time.ticks_diff(self._last_rx, since) > 0:
+            since = self._last_rx
+        left = self.timeout_ms - time.ticks_diff(time.ticks_ms(), since)
+        if left <= 0:
+            raise OSError(110)  # ETIMEDOUT
+        return left if wait < 0 or left < wait else wait
+
+    # With a keepalive period set, sends PINGREQ once nothing has been sent
+    # or received for half of it, and clears .healthy if the PINGRESP is
+    # not back within the other half. Called from every read and publish,
+    # so a client that regularly calls check_msg() keeps an idle link up
+    # and notices a dead one before its next publish.
+    def _keepalive(self):
+        if not self._ka or not self.healthy:
+            return
+        now = time.ticks_ms()
+        half = self._ka * 500
+        if self._ping_t is not None:
+            if time.ticks_diff(now, self._ping_t) >= half:
+                self.healthy = False
+        elif (
+            time.ticks_diff(now, self._last_tx) >= half
+            or time.ticks_diff(now, self._last_rx) >= half
+        ):
+            self._write(b"\xc0\0")  # PINGREQ
+            self._ping_t = now
+
+    # Returns the time in ms until _keepalive() has something to do,
+    # or -1 if keepalive is disabled.
+    def _ka_wait(self):
+        if not self._ka or not self.healthy:
+            return -1
+        now = time.ticks_ms()
+        half = self._ka * 500
+        if self._ping_t is not None:
+            left = half - time.ticks_diff(now, self._ping_t)
+        else:
+            left = half - max(
+                time.ticks_diff(now, self._last_tx), time.ticks_diff(now, self._last_rx)
+            )
+        return left if left > 0 else 0
+
+    def _rpid(self):
+        return self._rbuf[self._bs] << 8 | self._rbuf[self._bs + 1]
+
+    def _ifl_find(self, pid):
+        pids = self._ifl_pid
+        for i in range(len(pids)):
+            if pids[i] == pid:
+                return i
+        return -1
+
+    # Callers wait for room in the window first (see _wait_room()).
+    def _ifl_add(self, pid, pkt):
+        i = self._ifl_find(0)
+        assert i >= 0
+        self._ifl_pid[i] = pid
+        self._ifl_t[i] = time.ticks_ms()
+        self._ifl_pkt[i] = pkt
+        self._nifl += 1
+
+    def _ifl_ack(self, pid):
+        i = self._ifl_find(pid)
+        if i >= 0:
+            self._ifl_pid[i] = 0
+            self._ifl_pkt[i] = None
+            self._nifl -= 1
+
+    def _rx_find(self, pid):
+        pids = self._rx_pid
+        for i in range(len(pids)):
+            if pids[i] == pid:
+                return i
+        return -1
+
+    # Records the id of an incoming QoS 2 message. Returns False if it was
+    # delivered before and not released yet, i.e. this is a resend.
+    def _rx_new(self, pid):
+        if self._rx_find(pid) >= 0:
+            return False
+        j = self._rx_find(0)
+        if j < 0:
+            j = self._rx_next
+            self._rx_next = (j + 1) % _QOS2_RX
+        self._rx_pid[j] = pid
+        return True
+
+    def _send_ack(self, op, pid):
+        pkt = self._ack
+        pkt[0] = op
+        pkt[1] = 2
+        pkt[2] = pid >> 8
+        pkt[3] = pid & 0xFF
+        self._write(pkt)
+
+    # Resends unacknowledged packets older than retry_ms, PUBLISH frames
+    # with the DUP flag set. Returns the time in ms until the next is due.
+    def _retry(self):
+        now = time.ticks_ms()
+        due = self.retry_ms
+        for i in range(len(self._ifl_pid)):
+            if self._ifl_pid[i] and self._ifl_pkt[i] is not None:
+                left = self.retry_ms - time.ticks_diff(now, self._ifl_t[i])
+                if left <= 0:
+                    pkt = self._ifl_pkt[i]
+                    if pkt[0] & 0xF0 == 0x30:
+                        pkt[0] |= 0x08
+                    self._write(pkt)
+                    self._ifl_t[i] = now
+                    left = self.retry_ms
+                    if _METRICS:
+                        self._m[_M_RETRY] += 1
+                if left < due:
+                    due = left
+        return due
+
+    # Processes incoming packets until no more than n publishes are
+    # waiting for an acknowledgement.
+    def _wait_inflight(self, n):
+        t = time.ticks_ms()
+        while self._nifl > n:
+            op = self._read_pkt(False)
+            if op is None:
+                if not self.healthy:
+                    raise OSError(110)  # ETIMEDOUT
+                wait = self._retry()
+                w = self._wait_ms(t)
+                self._poll.poll(wait if w < 0 else min(wait, w))
+            else:
+                self._handle(op)
+
+    # Waits until one more QoS 1/2 publish fits in the in-flight window,
+    # which publishes resent after a reconnect can fill without anything
+    # new being sent.
+    def _wait_room(self):
+        if self._nifl >= self._window:
+            self._wait_inflight(self._window - 1)
+
+    # Blocks until every QoS 1/2 publish sent so far has completed.
+    def wait_acks(self):
+        self._wait_inflight(0)
+
     def set_callback(self, f):
         self.cb = f
 
+    # Has messages longer than chunk bytes delivered piecewise as
+    # f(topic, chunk, offset, total) instead of being buffered whole.
+    # chunk is a memoryview into the receive buffer, valid only during
+    # the call. Shorter messages still go to the .set_callback()
+    # function, or to f as a single chunk if there is none.
+    def set_stream_callback(self, f, chunk=256):
+        assert chunk > 0
+        self._scb = f
+        self._schunk = chunk
+
+    # Compresses publishes of threshold bytes or more when that makes
+    # them smaller, and inflates compressed incoming messages before they
+    # reach the callback (see umqtt.compress). With threshold=0 incoming
+    # messages are inflated but nothing is compressed. Returns whether
+    # publishes will be compressed, which needs firmware support.
+    def set_compression(self, threshold=128):
+        from umqtt import compress
+
+        self._z = compress
+        self._zmin = threshold if threshold and compress.can_pack() else 0
+        return self._zmin > 0
+
+    # Keeps the last retained payload of each subscribed topic, and any
+    # later message on a topic already kept, so that .retained() can
+    # answer without waiting for the broker. Topics and payloads take at
+    # most max_bytes (plus a per-entry overhead): the least recently
+    # updated entries make room for new ones, and a message that alone
+    # exceeds the budget is not kept. An empty message clears its topic.
+    # A topic that gets its first retained message after the subscription
+    # arrives as a live, non-retained one and is only kept once the broker
+    # resends it as retained on the next subscribe.
+    def set_retained_cache(self, max_bytes=1024):
+        self._rcache = {}
+        self._rc_bytes = 0
+        self._rc_max = max_bytes
+
+    # Returns the cached payload of topic, or default.
+    def retained(self, topic, default=None):
+        if self._rcache:
+            if isinstance(topic, str):
+                topic = topic.encode()
+            e = self._rcache.get(topic)
+            if e:
+                return e[0]
+        return default
+
+    def _cache(self, topic, msg):
+        c = self._rcache
+        e = c.pop(topic, None)
+        if e:
+            self._rc_bytes -= len(topic) + len(e[0]) + _RC_ENTRY
+        n = len(topic) + len(msg) + _RC_ENTRY
+        if not msg or n > self._rc_max:
+            return
+        while self._rc_bytes + n > self._rc_max:
+            t = min(c, key=lambda t: c[t][1])
+            self._rc_bytes -= len(t) + len(c.pop(t)[0]) + _RC_ENTRY
+        self._rc_seq += 1
+        c[topic] = (msg, self._rc_seq)
+        self._rc_bytes += n
+
     def set_last_will(self, topic, msg, retain=False, qos=0):
         assert 0 <= qos <= 2
         assert topic
@@ -61,155 +844,364 @@ class MQTTClient:
         self.lw_retain = retain
 
     def connect(self, clean_session=True):
+        if self.sock:
+            # Reconnecting; the previous socket may still be open.
+            try:
+                self.sock.close()
+            except OSError:
+                pass
         self.sock = socket.socket()
-        addr = socket.getaddrinfo(self.server, self.port)[0][-1]
-        self.sock.connect(addr)
+        addr = _resolve(self.server, self.port)
+        if self.timeout_ms:
+            self.sock.settimeout(self.timeout_ms / 1000)
+        try:
+            self.sock.connect(addr)
+        except OSError:
+            # The broker may have moved; look the name up again next time.
+            _dns.pop((self.server, self.port), None)
+            raise
         if self.ssl:
             self.sock = self.ssl.wrap_socket(self.sock, server_hostname=self.server)
-        premsg = bytearray(b"\x10\0\0\0\0\0")
-        msg = bytearray(b"\x04MQTT\x04\x02\0\0")
-
-        sz = 10 + 2 + len(self.client_id)
-        msg[6] = clean_session << 1
-        if self.user:
-            sz += 2 + len(self.user) + 2 + len(self.pswd)
-            msg[6] |= 0xC0
-        if self.keepalive:
-            assert self.keepalive < 65536
-            msg[7] |= self.keepalive >> 8
-            msg[8] |= self.keepalive & 0x00FF
-        if self.lw_topic:
-            sz += 2 + len(self.lw_topic) + 2 + len(self.lw_msg)
-            msg[6] |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
-            msg[6] |= self.lw_retain << 5
-
-        i = 1
-        while sz > 0x7F:
-            premsg[i] = (sz & 0x7F) | 0x80
-            sz >>= 7
-            i += 1
-        premsg[i] = sz
-
-        self.sock.write(premsg, i + 2)
-        self.sock.write(msg)
-        # print(hex(len(msg)), hexlify(msg, ":"))
-        self._send_str(self.client_id)
-        if self.lw_topic:
-            self._send_str(self.lw_topic)
-            self._send_str(self.lw_msg)
-        if self.user:
-            self._send_str(self.user)
-            self._send_str(self.pswd)
-        resp = self.sock.read(4)
-        assert resp[0] == 0x20 and resp[1] == 0x02
-        if resp[3] != 0:
-            raise MQTTException(resp[3])
-        return resp[2] & 1
+        self.sock.setblocking(True)
+        self._poll = select.poll()
+        self._poll.register(self.sock, select.POLLIN)
+        self._rreset()
+        self._ping_t = None
+        self._last_rx = time.ticks_ms()
+        self.healthy = True
+        self._write(self._connect_pkt(clean_session))
+        return self._connack(self._read_pkt(True, time.ticks_ms()))
 
     def disconnect(self):
-        self.sock.write(b"\xe0\0")
+        self.healthy = False
+        self._write(b"\xe0\0")
         self.sock.close()
 
     def ping(self):
-        self.sock.write(b"\xc0\0")
+        self._write(b"\xc0\0")
 
     def publish(self, topic, msg, retain=False, qos=0):
-        pkt = bytearray(b"\x30\0\0\0")
-        pkt[0] |= qos << 1 | retain
-        sz = 2 + len(topic) + len(msg)
+        self._keepalive()
         if qos > 0:
-            sz += 2
-        assert sz < 2097152
-        i = 1
-        while sz > 0x7F:
-            pkt[i] = (sz & 0x7F) | 0x80
-            sz >>= 7
-            i += 1
-        pkt[i] = sz
-        # print(hex(len(pkt)), hexlify(pkt, ":"))
-        self.sock.write(pkt, i + 1)
-        self._send_str(topic)
+            self._wait_room()
+        if self._publish(topic, msg, retain, qos):
+            # Returns as soon as fewer than max_inflight are outstanding,
+            # so max_inflight=1 waits for this message's PUBACK or PUBCOMP.
+            self._wait_inflight(self._window - 1)
+
+    # Sends a PUBLISH without waiting for acks and returns its packet id
+    # (0 for QoS 0).
+    def _publish(self, topic, msg, retain, qos):
+        n = self._batch_add(0, topic, msg, qos, retain)
+        self._write(self._wmv[:n])
+        return self.pid if qos > 0 else 0
+
+    # Encodes a PUBLISH at offset i of the packet buffer and returns the
+    # offset after it. QoS 1/2 frames are also copied to the in-flight
+    # table until acknowledged. If the frame would take a batch past
+    # _BATCH_MAX, the frames before it are written out first.
+    def _batch_add(self, i, topic, msg, qos, retain):
+        if isinstance(topic, str):
+            topic = topic.encode()
+        if isinstance(msg, str):
+            msg = msg.encode()
+        if self._zmin and len(msg) >= self._zmin:
+            z = self._z.pack(msg)
+            if len(z) < len(msg):
+                msg = z
+        # Fixed header is at most 5 bytes, topic length and packet id 2 each,
+        # MQTT 5 properties 4.
+        n = 13 + len(topic) + len(msg)
+        if i and i + n > _BATCH_MAX:
+            self._write(self._wmv[:i])
+            i = 0
+        buf = self._wbuf_for(i + n, i)
+        pid = self._next_pid() if qos > 0 else 0
+        t, alias = self._alias(topic) if self._alias_max else (topic, 0)
+        m = self._put_publish(buf, i, t, msg, retain, qos, pid, alias)
+        if _METRICS:
+            self._m[_M_PUB] += 1
+        # print(hex(m - i), hexlify(self._wmv[i:m], ":"))
         if qos > 0:
-            self.pid += 1
-            pid = self.pid
-            struct.pack_into("!H", pkt, 0, pid)
-            self.sock.write(pkt, 2)
-        self.sock.write(msg)
-        if qos == 1:
-            while 1:
-                op = self.wait_msg()
-                if op == 0x40:
-                    sz = self.sock.read(1)
-                    assert sz == b"\x02"
-                    rcv_pid = self.sock.read(2)
-                    rcv_pid = rcv_pid[0] << 8 | rcv_pid[1]
-                    if pid == rcv_pid:
-                        return
-        elif qos == 2:
-            assert 0
+            if alias:
+                # Aliases end with the connection, so the copy kept for
+                # retransmission carries the topic itself.
+                buf = self._wbuf_for(m + n, m)
+                k = self._put_publish(buf, m, topic, msg, retain, qos, pid)
+                self._ifl_add(pid, bytearray(self._wmv[m:k]))
+            else:
+                self._ifl_add(pid, bytearray(self._wmv[i:m]))
+        return m
 
+    # Publishes an iterable of (topic, msg, qos, retain) tuples. Frames are
+    # encoded back to back and written in as few writes as possible. When
+    # the in-flight window fills up, the batch so far is written and acks
+    # are awaited until half the window is free. Returns once every QoS 1/2
+    # message has been acknowledged.
+    def publish_many(self, msgs):
+        self._keepalive()
+        i = 0
+        for topic, msg, qos, retain in msgs:
+            if qos > 0 and self._nifl >= self._window:
+                if i:
+                    self._write(self._wmv[:i])
+                    i = 0
+                self._wait_inflight(self._window // 2)
+            i = self._batch_add(i, topic, msg, qos, retain)
+        if i:
+            self._write(self._wmv[:i])
+        self._wait_inflight(0)
+
+    # Publishes a size byte message without holding it in RAM. src is a
+    # stream with readinto() (e.g. an open file), a bytes-like object
+    # (e.g. a memoryview slice) or an iterable of chunks; payload data
+    # passes through the packet buffer. A streamed frame can't be
+    # retransmitted, so with QoS 1/2 the call waits for it to complete.
+    def publish_stream(self, topic, size, src, retain=False, qos=0):
+        self._keepalive()
+        if qos > 0:
+            self._wait_room()
+        pid = self._next_pid() if qos > 0 else 0
+        for b in self._stream_frame(topic, size, src, retain, qos, pid):
+            self._write(b)
+        if qos > 0:
+            self._wait_inflight(0)
+
+    # Yields the pieces of a streamed PUBLISH; each must be written
+    # before the next one is requested, as they share the packet buffer.
+    def _stream_frame(self, topic, size, src, retain, qos, pid):
+        if isinstance(topic, str):
+            topic = topic.encode()
+        if isinstance(src, (bytes, bytearray, memoryview)) and len(src) != size:
+            raise ValueError("payload size mismatch")
+        buf = self._wbuf_for(max(_CHUNK, 13 + len(topic)))
+        mv = self._wmv
+        cap = len(buf)
+        t, alias = self._alias(topic) if self._alias_max else (topic, 0)
+        i = self._put_publish_hdr(buf, 0, t, size, retain, qos, pid, alias)
+        if _METRICS:
+            self._m[_M_PUB] += 1
+        if qos > 0:
+            self._ifl_add(pid, None)
+        left = size
+        if hasattr(src, "readinto"):
+            while left:
+                n = src.readinto(mv[i : min(cap, i + left)])
+                if not n:
+                    break
+                i += n
+                left -= n
+                if i == cap:
+                    yield mv[:i]
+                    i = 0
+        elif isinstance(src, (bytes, bytearray, memoryview)):
+            yield mv[:i]
+            i = left = 0
+            yield src
+        else:
+            for chunk in src:
+                n = len(chunk)
+                if n > left:
+                    left = -1
+                    break
+                if i + n > cap:
+                    yield mv[:i]
+                    i = 0
+                if n > cap:
+                    yield chunk
+                else:
+                    mv[i : i + n] = chunk
+                    i += n
+                left -= n
+        if left:
+            # The source gave fewer (or more) bytes than announced and part
+            # of the frame is already out, so the connection is unusable.
+            self.healthy = False
+            self.sock.close()
+            raise ValueError("payload size mismatch")
+        if i:
+            yield mv[:i]
+
+    # topic is a single filter, or a list of (filter, qos) pairs that are
+    # all subscribed with one SUBSCRIBE packet.
     def subscribe(self, topic, qos=0):
-        assert self.cb is not None, "Subscribe callback is not set"
-        pkt = bytearray(b"\x82\0\0\0")
-        self.pid += 1
-        struct.pack_into("!BH", pkt, 1, 2 + 2 + len(topic) + 1, self.pid)
-        # print(hex(len(pkt)), hexlify(pkt, ":"))
-        self.sock.write(pkt)
-        self._send_str(topic)
-        self.sock.write(qos.to_bytes(1, "little"))
+        assert self.cb or self._scb or self._rcache is not None, "Subscribe callback is not set"
+        pid = self._subscribe(topic, qos)
+        t = time.ticks_ms()
         while 1:
-            op = self.wait_msg()
+            op = self._handle(self._read_pkt(True, t))
             if op == 0x90:
-                resp = self.sock.read(4)
-                # print(resp)
-                assert resp[1] == pkt[2] and resp[2] == pkt[3]
-                if resp[3] == 0x80:
-                    raise MQTTException(resp[3])
-                return
+                assert self._rpid() == pid
+                i = self._skip_props(self._bs + 2)
+                return self._suback(topic, self._rmv[i : self._be])
+
+    def _subscribe(self, topic, qos):
+        if isinstance(topic, (list, tuple)):
+            filters = [(t.encode() if isinstance(t, str) else t, q) for t, q in topic]
+        else:
+            filters = ((topic.encode() if isinstance(topic, str) else topic, qos),)
+        sz = 3 if self.version == 5 else 2
+        for t, q in filters:
+            sz += 2 + len(t) + 1
+        pid = self._next_pid()
+        buf = self._wbuf_for(sz + 5)
+        buf[0] = 0x82
+        i = self._put_len(buf, 1, sz)
+        buf[i] = pid >> 8
+        buf[i + 1] = pid & 0xFF
+        i += 2
+        if self.version == 5:
+            buf[i] = 0  # no properties
+            i += 1
+        for t, q in filters:
+            i = self._put_str(buf, i, t)
+            buf[i] = q
+            i += 1
+        # print(hex(i), hexlify(self._wmv[:i], ":"))
+        self._write(self._wmv[:i])
+        return pid
+
+    # Turns SUBACK return codes into the result of subscribe(): the granted
+    # QoS of a single filter (raising if it was rejected), or a list with
+    # one code per filter (0x80 or above if rejected) for a multi-filter
+    # subscribe.
+    def _suback(self, topic, codes):
+        # print(bytes(codes))
+        if isinstance(topic, (list, tuple)):
+            return list(codes)
+        if codes[0] >= 0x80:
+            raise MQTTException(codes[0])
+        return codes[0]
 
     # Wait for a single incoming MQTT message and process it.
     # Subscribed messages are delivered to a callback previously
     # set by .set_callback() method. Other (internal) MQTT
     # messages processed internally.
     def wait_msg(self):
-        res = self.sock.read(1)
-        self.sock.setblocking(True)
-        if res is None:
+        return self._handle(self._read_pkt(True))
+
+    # Checks whether a pending message from server is available.
+    # If not, returns immediately with None. Otherwise, does
+    # the same processing as wait_msg. A partially received
+    # packet stays buffered until a later call completes it.
+    def check_msg(self):
+        return self._handle(self._read_pkt(False))
+
+    # Returns whether a complete packet is waiting in the receive buffer.
+    # One read can bring several packets, and the socket is no longer
+    # readable while they wait, so callers that poll the socket or call
+    # check_msg() once per tick should call it again while this is true.
+    def pending(self):
+        buf = self._rbuf
+        i = self._rpos
+        end = self._rend
+        if self._op is not None:
+            return end - i >= self._sz
+        j = i + 1
+        sz = sh = 0
+        while 1:
+            if j >= end:
+                return False
+            b = buf[j]
+            j += 1
+            sz |= (b & 0x7F) << sh
+            if not b & 0x80:
+                return end - j >= sz
+            sh += 7
+
+    # Processes a packet left in the receive buffer by _read_pkt().
+    # The body of a non-PUBLISH packet stays readable at [_bs, _be)
+    # until the next read, so callers can inspect acks.
+    def _handle(self, op):
+        if op is None:
             return None
-        if res == b"":
-            raise OSError(-1)
-        if res == b"\xd0":  # PINGRESP
-            sz = self.sock.read(1)[0]
-            assert sz == 0
+        if op == 0xD0:  # PINGRESP
+            assert self._be == self._bs
+            self._ping_t = None
             return None
-        op = res[0]
+        if op == 0x40 or op == 0x70:  # PUBACK, PUBCOMP
+            assert self._be - self._bs >= 2
+            pid = self._rpid()
+            if _METRICS:
+                i = self._ifl_find(pid)
+                if i >= 0:
+                    self._ack_time(i)
+            self._ifl_ack(pid)
+            if op == 0x40 and self._rc() >= 0x80:
+                self._nack(pid, self._rc())
+            return op
+        if op == 0x50:  # PUBREC
+            pid = self._rpid()
+            if self._rc() >= 0x80:
+                # Rejected; the exchange ends without PUBREL.
+                self._ifl_ack(pid)
+                self._nack(pid, self._rc())
+                return op
+            i = self._ifl_find(pid)
+            if i >= 0:
+                self._ifl_pkt[i] = bytearray(b"\x62\x02\0\0")
+                struct.pack_into("!H", self._ifl_pkt[i], 2, pid)
+                self._ifl_t[i] = time.ticks_ms()
+            self._send_ack(0x62, pid)
+            return op
+        if op == 0x62:  # PUBREL
+            pid = self._rpid()
+            i = self._rx_find(pid)
+            if i >= 0:
+                self._rx_pid[i] = 0
+            self._send_ack(0x70, pid)
+            return op
+        if op == 0xE0:  # DISCONNECT, MQTT 5 only
+            self.healthy = False
+            raise MQTTException(self._rbuf[self._bs] if self._be > self._bs else 0)
         if op & 0xF0 != 0x30:
             return op
-        sz = self._recv_len()
-        topic_len = self.sock.read(2)
-        topic_len = (topic_len[0] << 8) | topic_len[1]
-        topic = self.sock.read(topic_len)
-        sz -= topic_len + 2
+        if self._stopic is not None:
+            # Streamed PUBLISH; its payload has been delivered already.
+            self._stopic = None
+            if op & 6:
+                self._send_ack(0x50 if op & 6 == 4 else 0x40, self._spid)
+            return op
+        mv = self._rmv
+        i = self._bs
+        topic_len = self._rpid()
+        topic = bytes(mv[i + 2 : i + 2 + topic_len])
         if op & 6:
-            pid = self.sock.read(2)
-            pid = pid[0] << 8 | pid[1]
-            sz -= 2
-        msg = self.sock.read(sz)
-        self.cb(topic, msg)
+            pid = self._rbuf[i + 2 + topic_len] << 8 | self._rbuf[i + 3 + topic_len]
+        i += self._pub_hdr(op, i, self._be)
+        if op & 6 == 4:
+            # A QoS 2 message is delivered once; a resend with an id that
+            # has not been released yet is only acknowledged again.
+            if self._rx_new(pid):
+                self._deliver(topic, i, op & 1)
+            self._send_ack(0x50, pid)
+            return op
+        self._deliver(topic, i, op & 1)
         if op & 6 == 2:
-            pkt = bytearray(b"\x40\x02\0\0")
-            struct.pack_into("!H", pkt, 2, pid)
-            self.sock.write(pkt)
-        elif op & 6 == 4:
-            assert 0
+            self._send_ack(0x40, pid)
         return op
 
-    # Checks whether a pending message from server is available.
-    # If not, returns immediately with None. Otherwise, does
-    # the same processing as wait_msg.
-    def check_msg(self):
-        self.sock.setblocking(False)
-        return self.wait_msg()
+    # Reason code of the ack in the receive buffer (0 if left out).
+    def _rc(self):
+        return self._rbuf[self._bs + 2] if self._be - self._bs > 2 else 0
+
+    # Called when the broker rejects publish pid with reason code rc.
+    def _nack(self, pid, rc):
+        raise MQTTException(rc)
+
+    def _deliver(self, topic, i, retain):
+        msg = self._rmv[i : self._be]
+        if self._z and self._be - i >= 2:
+            m = self._z.MARKER
+            if self._rbuf[i] == m[0] and self._rbuf[i + 1] == m[1]:
+                msg = self._z.unpack(msg)
+        if self._rcache is not None and (retain or topic in self._rcache):
+            msg = bytes(msg)
+            self._cache(topic, msg)
+        if self.cb:
+            self.cb(topic, bytes(msg))
+        elif self._scb:
+            self._scb(topic, msg, 0, len(msg))
 
 
 __version__ = '1.4.0'
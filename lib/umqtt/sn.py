@@ -0,0 +1,298 @@
+# MQTT-SN 1.2 client over UDP, for nodes that wake up, send a reading and
+# go back to sleep: no TCP handshake, no session to keep alive, and with
+# QoS -1 not even a connection. It follows umqtt.simple: topics and
+# payloads may be str or bytes, the callback gets (topic, msg) as bytes
+# (a umqtt.router.Router works too) and broker names go through the same
+# resolver cache. Topics travel as 2-byte ids: predefined ones agreed
+# with the gateway and passed to the constructor, 2-character short
+# names, or ids the gateway assigns on first use (REGISTER).
+#
+#   c = MQTTSNClient("node-2", "192.168.1.157", topics={"sensor/dht22/2/data": 1})
+#   c.publish("sensor/dht22/2/data", payload, qos=-1)  # no connect() needed
+
+import usocket as socket
+import ustruct as struct
+import uselect as select
+import utime as time
+from micropython import const
+from umqtt.simple import MQTTException, _resolve
+
+_CONNECT = const(0x04)
+_CONNACK = const(0x05)
+_REGISTER = const(0x0A)
+_REGACK = const(0x0B)
+_PUBLISH = const(0x0C)
+_PUBACK = const(0x0D)
+_SUBSCRIBE = const(0x12)
+_SUBACK = const(0x13)
+_PINGREQ = const(0x16)
+_PINGRESP = const(0x17)
+_DISCONNECT = const(0x18)
+
+# Set in the flags byte of a resent PUBLISH or SUBSCRIBE.
+_DUP = const(0x80)
+# Topic id types in the flags byte.
+_TID_NORMAL = const(0)
+_TID_PREDEF = const(1)
+_TID_SHORT = const(2)
+
+# Largest datagram received.
+_RX_MAX = const(512)
+
+
+class MQTTSNClient:
+    def __init__(
+        self,
+        client_id,
+        server,
+        port=1884,
+        keepalive=0,
+        topics=None,
+        retry_ms=1000,
+        retries=3,
+    ):
+        self.client_id = client_id
+        self.server = server
+        self.port = port
+        self.keepalive = keepalive
+        self.retry_ms = retry_ms
+        self.retries = retries
+        self.cb = None
+        self.sock = None
+        self._poll = None
+        self.msg_id = 0
+        # Predefined topics: name -> id and id -> name.
+        self._predef = {}
+        self._pnames = {}
+        for name, tid in (topics or {}).items():
+            if isinstance(name, str):
+                name = name.encode()
+            self._predef[name] = tid
+            self._pnames[tid] = name
+        # Topics registered with the gateway in this session, both ways.
+        self._ids = {}
+        self._names = {}
+        self._wbuf = bytearray(64)
+        self._wmv = memoryview(self._wbuf)
+        self._rbuf = bytearray(_RX_MAX)
+        self._rmv = memoryview(self._rbuf)
+        # Body of the last packet received is [_bs, _be).
+        self._bs = 0
+        self._be = 0
+        self._last_tx = 0
+
+    def set_callback(self, f):
+        self.cb = f
+
+    def _open(self):
+        if self.sock is None:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.connect(_resolve(self.server, self.port))
+            self._poll = select.poll()
+            self._poll.register(self.sock, select.POLLIN)
+
+    def _next_id(self):
+        self.msg_id = self.msg_id % 65535 + 1
+        return self.msg_id
+
+    # Sends a packet of type typ: the fields packed by fmt, then data.
+    def _send(self, typ, data, fmt, *vals):
+        n = 2 + struct.calcsize(fmt) + len(data)
+        i = 2
+        if n > 255:
+            n += 2
+            i = 4
+        if len(self._wbuf) < n:
+            self._wbuf = bytearray(n)
+            self._wmv = memoryview(self._wbuf)
+        buf = self._wbuf
+        if i == 4:
+            struct.pack_into("!BHB", buf, 0, 1, n, typ)
+        else:
+            buf[0] = n
+            buf[1] = typ
+        struct.pack_into(fmt, buf, i, *vals)
+        buf[n - len(data) : n] = data
+        self.sock.send(self._wmv[:n])
+        self._last_tx = time.ticks_ms()
+
+    # Waits up to wait ms (-1: without limit) for a datagram and returns
+    # its packet type, leaving the body at [_bs, _be), or None.
+    def _recv(self, wait):
+        if not self._poll.poll(wait):
+            return None
+        n = self.sock.readinto(self._rbuf)
+        if not n or n < 2:
+            return None
+        buf = self._rbuf
+        if buf[0] == 1:
+            self._bs = 4
+            self._be = min(n, buf[1] << 8 | buf[2])
+            return buf[3]
+        self._bs = 2
+        self._be = min(n, buf[0])
+        return buf[1]
+
+    def _u16(self, i):
+        return self._rbuf[i] << 8 | self._rbuf[i + 1]
+
+    # Sends a request and waits for the reply of type want whose message
+    # id is at offset mid_at of its body (None: no id), resending it
+    # every retry_ms. Other packets are handled meanwhile. The flags byte
+    # of a PUBLISH or SUBSCRIBE comes first and gets the DUP flag on resends.
+    def _request(self, want, mid_at, typ, data, fmt, *vals):
+        for n in range(self.retries + 1):
+            if n == 1 and (typ == _PUBLISH or typ == _SUBSCRIBE):
+                vals = (vals[0] | _DUP,) + vals[1:]
+            self._send(typ, data, fmt, *vals)
+            deadline = time.ticks_add(time.ticks_ms(), self.retry_ms)
+            while 1:
+                left = time.ticks_diff(deadline, time.ticks_ms())
+                if left <= 0:
+                    break
+                op = self._recv(left)
+                if op is None:
+                    continue
+                if op == want and (mid_at is None or self._u16(self._bs + mid_at) == self.msg_id):
+                    return
+                self._handle(op)
+        raise OSError(110)  # ETIMEDOUT
+
+    def connect(self, clean_session=True):
+        self._open()
+        cid = self.client_id
+        if isinstance(cid, str):
+            cid = cid.encode()
+        self._request(_CONNACK, None, _CONNECT, cid, "!BBH", clean_session << 2, 1, self.keepalive)
+        rc = self._rbuf[self._bs]
+        if rc:
+            raise MQTTException(rc)
+        if clean_session:
+            self._ids = {}
+            self._names = {}
+
+    def disconnect(self):
+        self._send(_DISCONNECT, b"", "")
+        self.sock.close()
+        self.sock = None
+
+    def ping(self):
+        self._send(_PINGREQ, b"", "")
+
+    # Asks the gateway for the id of topic and returns it.
+    def register(self, topic):
+        if isinstance(topic, str):
+            topic = topic.encode()
+        mid = self._next_id()
+        self._request(_REGACK, 2, _REGISTER, topic, "!HH", 0, mid)
+        rc = self._rbuf[self._bs + 4]
+        if rc:
+            raise MQTTException(rc)
+        tid = self._u16(self._bs)
+        self._ids[topic] = tid
+        self._names[tid] = topic
+        return tid
+
+    # Returns the id and id type to publish topic with.
+    def _topic_id(self, topic, qos):
+        tid = self._predef.get(topic)
+        if tid is not None:
+            return tid, _TID_PREDEF
+        if len(topic) == 2:
+            return topic[0] << 8 | topic[1], _TID_SHORT
+        assert qos >= 0, "QoS -1 needs a predefined or short topic"
+        tid = self._ids.get(topic)
+        if tid is None:
+            tid = self.register(topic)
+        return tid, _TID_NORMAL
+
+    # qos is 0, 1 or -1. QoS -1 needs neither connect() nor an ack: the
+    # message is sent in one datagram to the gateway, which publishes it
+    # at QoS 0.
+    def publish(self, topic, msg, retain=False, qos=0):
+        assert -1 <= qos <= 1
+        if isinstance(topic, str):
+            topic = topic.encode()
+        if isinstance(msg, str):
+            msg = msg.encode()
+        self._open()
+        self._keepalive()
+        tid, tt = self._topic_id(topic, qos)
+        flags = (qos & 3) << 5 | retain << 4 | tt
+        if qos != 1:
+            self._send(_PUBLISH, msg, "!BHH", flags, tid, 0)
+            return
+        mid = self._next_id()
+        self._request(_PUBACK, 2, _PUBLISH, msg, "!BHH", flags, tid, mid)
+        rc = self._rbuf[self._bs + 4]
+        if rc:
+            if tt == _TID_NORMAL:
+                # The gateway lost the registration; register again next time.
+                self._ids.pop(topic, None)
+            raise MQTTException(rc)
+
+    # Returns the granted QoS.
+    def subscribe(self, topic, qos=0):
+        assert self.cb is not None, "Subscribe callback is not set"
+        if isinstance(topic, str):
+            topic = topic.encode()
+        mid = self._next_id()
+        flags = qos << 5
+        tid = self._predef.get(topic)
+        if tid is not None:
+            self._request(_SUBACK, 3, _SUBSCRIBE, b"", "!BHH", flags | _TID_PREDEF, mid, tid)
+        else:
+            if len(topic) == 2:
+                flags |= _TID_SHORT
+            self._request(_SUBACK, 3, _SUBSCRIBE, topic, "!BH", flags, mid)
+        rc = self._rbuf[self._bs + 5]
+        if rc:
+            raise MQTTException(rc)
+        tid = self._u16(self._bs + 1)
+        if tid and flags & 3 == _TID_NORMAL:
+            self._ids[topic] = tid
+            self._names[tid] = topic
+        return self._rbuf[self._bs] >> 5 & 3
+
+    def _keepalive(self):
+        if self.keepalive and self.sock:
+            if time.ticks_diff(time.ticks_ms(), self._last_tx) >= self.keepalive * 500:
+                self.ping()
+
+    def wait_msg(self):
+        self._keepalive()
+        return self._handle(self._recv(-1))
+
+    def check_msg(self):
+        self._keepalive()
+        return self._handle(self._recv(0))
+
+    def _handle(self, op):
+        if op == _PUBLISH:
+            buf = self._rbuf
+            i = self._bs
+            flags = buf[i]
+            tid = self._u16(i + 1)
+            tt = flags & 3
+            if tt == _TID_SHORT:
+                topic = bytes(self._rmv[i + 1 : i + 3])
+            elif tt == _TID_PREDEF:
+                topic = self._pnames.get(tid)
+            else:
+                topic = self._names.get(tid)
+            rc = 0 if topic is not None else 2  # invalid topic id
+            if topic is not None:
+                self.cb(topic, bytes(self._rmv[i + 5 : self._be]))
+            if flags & 0x60 == 0x20 or rc:
+                self._send(_PUBACK, b"", "!HHB", tid, self._u16(i + 3), rc)
+        elif op == _REGISTER:
+            # Id of a topic the gateway is about to publish to us.
+            i = self._bs
+            tid = self._u16(i)
+            topic = bytes(self._rmv[i + 4 : self._be])
+            self._ids[topic] = tid
+            self._names[tid] = topic
+            self._send(_REGACK, b"", "!HHB", tid, self._u16(i + 2), 0)
+        elif op == _DISCONNECT:
+            raise OSError(-1)
+        return op
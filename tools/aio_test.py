@@ -0,0 +1,88 @@
+"""
+asyncio MQTT 客户端测试（在电脑上用 CPython 运行）
+用本地 MQTT 服务器替身检查 umqtt.aio.MQTTClient:
+1. 并发发布: 多个协程同时发布 QoS 1 / QoS 2 消息，全部完成且有多条同时在途
+2. publish_many: 一批 QoS 0 / 1 / 2 混合消息全部完成
+3. 重连: 服务器断开连接后重连同一个客户端（BrokerPool.aconnect 的做法），
+   之后只有一个读取任务和一个心跳任务，并能继续发布
+
+用法:  python3 tools/aio_test.py
+"""
+
+import asyncio
+import socket
+import sys
+
+import host_compat
+from failover_test import StandInBroker
+from qos2_test import max_outstanding, wait_for
+
+COUNT = 40
+MAX_INFLIGHT = 8
+
+
+def client_tasks():
+    """返回客户端后台任务数: (读取任务, 心跳任务)"""
+    names = [t.get_coro().__qualname__ for t in asyncio.all_tasks() if not t.done()]
+    return names.count("MQTTClient._read_loop"), names.count("MQTTClient._keepalive_loop")
+
+
+async def test_concurrent(client, broker):
+    """COUNT 个协程同时发布，QoS 1 和 QoS 2 交替"""
+    broker.received.clear()
+    await asyncio.gather(*(
+        client.publish("aio/test", str(i), qos=1 + i % 2) for i in range(COUNT)))
+    publishes = sum(op & 0xF0 == 0x30 for op, _ in broker.received)
+    most = max_outstanding(broker.received)
+    print(f"并发发布: PUBLISH={publishes} 最多同时在途 QoS 2={most} 未完成={client._nifl}")
+    return publishes == COUNT and client._nifl == 0 and most > 1
+
+
+async def test_publish_many(client, broker):
+    """publish_many 发布 COUNT 条 QoS 0 / 1 / 2 混合消息"""
+    broker.received.clear()
+    await client.publish_many(("aio/many", str(i), i % 3, False) for i in range(COUNT))
+    ok = wait_for(lambda: sum(op & 0xF0 == 0x30 for op, _ in broker.received) >= COUNT)
+    publishes = sum(op & 0xF0 == 0x30 for op, _ in broker.received)
+    pubrels = sum(op == 0x62 for op, _ in broker.received)
+    print(f"publish_many: PUBLISH={publishes} PUBREL={pubrels} 未完成={client._nifl}")
+    return ok and publishes == COUNT and pubrels == COUNT // 3 and client._nifl == 0
+
+
+async def test_reconnect(client, broker):
+    """服务器断开后重连两次，检查后台任务没有残留"""
+    broker.conns[-1].shutdown(socket.SHUT_RDWR)
+    for _ in range(100):
+        if not client.isconnected():
+            break
+        await asyncio.sleep(0.01)
+    dropped = not client.isconnected()
+    for _ in range(2):
+        await client.connect()
+    await asyncio.sleep(0.1)
+    readers, keepalives = client_tasks()
+    await client.publish("aio/test", "after", qos=1)
+    print(f"重连: 检测到断开={dropped} 读取任务={readers} 心跳任务={keepalives}")
+    return dropped and readers == 1 and keepalives == 1
+
+
+async def run():
+    from umqtt.aio import MQTTClient
+
+    broker = StandInBroker("aio")
+    client = MQTTClient("aio-test", "127.0.0.1", broker.port, keepalive=4,
+                        max_inflight=MAX_INFLIGHT, timeout_ms=2000)
+    await client.connect()
+    ok = await test_concurrent(client, broker)
+    ok = await test_publish_many(client, broker) and ok
+    ok = await test_reconnect(client, broker) and ok
+    await client.disconnect()
+    await asyncio.sleep(0)
+    return ok and client_tasks() == (0, 0)
+
+
+if __name__ == "__main__":
+    host_compat.install()
+    ok = asyncio.run(run())
+    print("通过" if ok else "失败")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,67 @@
+"""
+MQTT 消息压缩基准测试
+对传感器 JSON、批量数据和日志文本分别测量压缩后节省的字节数和压缩 / 解压耗时，
+用来选择 MQTTClient.set_compression() 的阈值。
+
+可在 Pico 上运行（把 lib/umqtt 复制到设备后用 Thonny 运行本文件，得到 RP2040 上的耗时），
+也可在电脑上运行:  python3 tools/compress_bench.py
+"""
+
+import sys
+import time
+
+try:
+    ticks_us = time.ticks_us
+    ticks_diff = time.ticks_diff
+except AttributeError:
+    # CPython
+    import os
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lib"))
+    ticks_us = lambda: int(time.perf_counter() * 1000000)
+    ticks_diff = lambda a, b: a - b
+
+from umqtt import compress
+
+ROUNDS = 20
+
+
+def sample_payloads():
+    """生成测试用的消息内容"""
+    reading = '{"created_at": "2025-01-01T08:00:00+08:00", "temperature": 21.5, "humidity": 45.2}'
+    batch = "[" + ", ".join([reading] * 10) + "]"
+    log = "".join(
+        "[01-01 08:{:02d}:00] [INFO] 数据已发布: 温度=21.{}°C, 湿度=45.{}%\n".format(i % 60, i % 10, i % 7)
+        for i in range(40)
+    )
+    return [
+        ("单条读数", reading.encode()),
+        ("10 条读数", batch.encode()),
+        ("日志 40 行", log.encode()),
+    ]
+
+
+def measure(func, data):
+    """返回 func(data) 的平均耗时（微秒）和结果"""
+    start = ticks_us()
+    for _ in range(ROUNDS):
+        result = func(data)
+    return ticks_diff(ticks_us(), start) // ROUNDS, result
+
+
+def main():
+    if not compress.can_pack():
+        print("当前固件不支持压缩")
+        return
+
+    print("{:<10} {:>6} {:>6} {:>6} {:>9} {:>9}".format(
+        "消息", "原始", "压缩后", "节省", "压缩us", "解压us"))
+    for name, data in sample_payloads():
+        pack_us, packed = measure(compress.pack, data)
+        unpack_us, unpacked = measure(compress.unpack, packed)
+        assert unpacked == data
+        print("{:<10} {:>6} {:>6} {:>6} {:>9} {:>9}".format(
+            name, len(data), len(packed), len(data) - len(packed), pack_us, unpack_us))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+MQTT 多服务器故障切换测试（在电脑上用 CPython 运行）
+启动两个本地 MQTT 服务器替身，客户端通过 BrokerPool 连接并持续发布，
+中途让正在使用的服务器断开（kill）或停止响应（freeze），测量切换到另一台服务器所需的时间。
+
+用法:  python3 tools/failover_test.py [kill|freeze]
+"""
+
+import socket
+import struct
+import sys
+import threading
+import time
+
+import host_compat
+
+KEEPALIVE = 4       # 客户端心跳周期（秒），切换应在一个周期内完成
+TIMEOUT_MS = 1000   # 客户端单次操作超时
+PUBLISH_INTERVAL = 0.05
+
+
+# ==================== MQTT 服务器替身 ====================
+class StandInBroker:
+    """只实现 CONNECT / PUBLISH（QoS 0-2）/ PINGREQ / DISCONNECT 的 MQTT 3.1.1 服务器"""
+
+    def __init__(self, name):
+        self.name = name
+        self.frozen = False
+        self.published = 0
+        self.received = []  # 收到的 (报文类型, 报文体)
+        self.conns = []
+        self.srv = socket.socket()
+        self.srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.srv.bind(("127.0.0.1", 0))
+        self.srv.listen(4)
+        self.port = self.srv.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.srv.accept()
+            except OSError:
+                return
+            self.conns.append(conn)
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _recv(self, conn, n):
+        data = b""
+        while len(data) < n:
+            chunk = conn.recv(n - len(data))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        return data
+
+    def _serve(self, conn):
+        try:
+            while True:
+                op = self._recv(conn, 1)[0]
+                size = shift = 0
+                while True:
+                    b = self._recv(conn, 1)[0]
+                    size |= (b & 0x7F) << shift
+                    shift += 7
+                    if not b & 0x80:
+                        break
+                body = self._recv(conn, size)
+                if self.frozen:
+                    continue
+                kind = op & 0xF0
+                self.received.append((op, body))
+                if kind == 0x10:
+                    conn.sendall(b"\x20\x02\x00\x00")
+                elif kind == 0x30:
+                    self.published += 1
+                    if op & 6:
+                        topic_len = struct.unpack("!H", body[:2])[0]
+                        ack = b"\x50\x02" if op & 6 == 4 else b"\x40\x02"
+                        conn.sendall(ack + body[2 + topic_len:4 + topic_len])
+                elif kind == 0x60:
+                    conn.sendall(b"\x70\x02" + body[:2])
+                elif kind == 0xC0:
+                    conn.sendall(b"\xd0\x00")
+                elif kind == 0xE0:
+                    break
+        except (EOFError, OSError):
+            pass
+        conn.close()
+
+    def send(self, data):
+        """向最近建立的连接发送原始报文"""
+        self.conns[-1].sendall(data)
+
+    def kill(self):
+        """关闭监听和全部连接"""
+        self.srv.close()
+        for conn in self.conns:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+                conn.close()
+            except OSError:
+                pass
+
+    def freeze(self):
+        """保持连接但不再应答（模拟半开连接）"""
+        self.frozen = True
+
+
+# ==================== 测试 ====================
+def run(mode):
+    host_compat.install()
+    from umqtt.simple import MQTTClient
+    from umqtt.pool import BrokerPool
+
+    brokers = {}
+    for name in ("A", "B"):
+        broker = StandInBroker(name)
+        brokers[broker.port] = broker
+
+    pool = BrokerPool([("127.0.0.1", port) for port in brokers])
+    client = MQTTClient("failover-test", "", keepalive=KEEPALIVE, timeout_ms=TIMEOUT_MS)
+    pool.connect(client)
+    first = brokers[client.port]
+    print(f"已连接到服务器 {first.name}")
+
+    failed_at = None
+    deadline = time.monotonic() + 4 * KEEPALIVE
+    while time.monotonic() < deadline:
+        if failed_at is None and first.published >= 20:
+            getattr(first, mode)()
+            failed_at = time.monotonic()
+            print(f"服务器 {first.name}: {mode}")
+        try:
+            client.publish("failover/test", "x", qos=1)
+        except Exception as e:
+            print(f"发布失败 ({type(e).__name__}: {e})，切换服务器")
+            try:
+                pool.connect(client)
+            except Exception as e:
+                print(f"重连失败: {e}")
+                time.sleep(PUBLISH_INTERVAL)
+                continue
+            current = brokers[client.port]
+            if failed_at is not None and current is not first:
+                took = time.monotonic() - failed_at
+                print(f"已切换到服务器 {current.name}，用时 {took:.2f} 秒")
+                for host, port, score, connects, fails in pool.status():
+                    print(f"  {brokers[port].name}: 评分={score} 连接={connects} 失败={fails}")
+                client.publish("failover/test", "x", qos=1)
+                return took <= KEEPALIVE
+        time.sleep(PUBLISH_INTERVAL)
+
+    print("未能切换服务器")
+    return False
+
+
+if __name__ == "__main__":
+    mode = sys.argv[1] if len(sys.argv) > 1 else "kill"
+    if mode not in ("kill", "freeze"):
+        sys.exit(__doc__)
+    ok = run(mode)
+    print("通过" if ok else "失败")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,99 @@
+"""
+在电脑上（CPython）运行 lib/umqtt 的兼容层
+把 umqtt 用到的 MicroPython 模块（usocket、utime、uasyncio 等）映射到 CPython 的对应模块，
+供 tools/ 下的测试和网关脚本使用。
+
+用法:
+    import host_compat
+    host_compat.install()
+    from umqtt.simple import MQTTClient
+"""
+
+import asyncio
+import os
+import select
+import socket
+import struct
+import sys
+import time
+import types
+
+
+class _Socket:
+    """提供 MicroPython 风格 write / readinto 的 socket（TCP 或 UDP）"""
+
+    def __init__(self, family=socket.AF_INET, type=socket.SOCK_STREAM, *args):
+        self._s = socket.socket(family, type)
+
+    def connect(self, addr):
+        self._s.connect(addr)
+
+    def settimeout(self, t):
+        self._s.settimeout(t)
+
+    def setblocking(self, flag):
+        self._s.setblocking(flag)
+
+    def fileno(self):
+        return self._s.fileno()
+
+    def write(self, buf):
+        self._s.sendall(buf)
+        return len(buf)
+
+    def send(self, buf):
+        return self._s.send(buf)
+
+    def readinto(self, buf):
+        try:
+            return self._s.recv_into(buf)
+        except BlockingIOError:
+            return None
+
+    def close(self):
+        self._s.close()
+
+
+async def _readinto(self, buf):
+    """uasyncio 的 StreamReader.readinto: 读入 buf，返回字节数（0 表示连接已关闭）"""
+    data = await self.read(len(buf))
+    buf[: len(data)] = data
+    return len(data)
+
+
+def install():
+    """把 umqtt 用到的 MicroPython 模块映射到 CPython 模块，并把 lib 加入搜索路径"""
+    usocket = types.ModuleType("usocket")
+    usocket.socket = _Socket
+    usocket.getaddrinfo = socket.getaddrinfo
+    usocket.AF_INET = socket.AF_INET
+    usocket.SOCK_STREAM = socket.SOCK_STREAM
+    usocket.SOCK_DGRAM = socket.SOCK_DGRAM
+
+    period = 1 << 30
+    utime = types.ModuleType("utime")
+    utime.ticks_ms = lambda: int(time.monotonic() * 1000) % period
+    utime.ticks_us = lambda: int(time.monotonic() * 1000000) % period
+    utime.ticks_add = lambda t, d: (t + d) % period
+    utime.ticks_diff = lambda a, b: ((a - b + period // 2) % period) - period // 2
+    utime.sleep_ms = lambda ms: time.sleep(ms / 1000)
+
+    micropython = types.ModuleType("micropython")
+    micropython.const = lambda x: x
+
+    if not hasattr(asyncio.StreamReader, "readinto"):
+        asyncio.StreamReader.readinto = _readinto
+
+    import array
+    import binascii
+    sys.modules.update({
+        "usocket": usocket,
+        "ustruct": struct,
+        "uselect": select,
+        "utime": utime,
+        "uarray": array,
+        "ubinascii": binascii,
+        "micropython": micropython,
+        "uasyncio": asyncio,
+    })
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib"))
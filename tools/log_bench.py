@@ -0,0 +1,101 @@
+"""
+日志写入基准测试（在电脑上用 CPython 运行）
+比较 SimpleLogger 每行立即写入（buffer_size=0）和内存缓冲批量写入时，
+写入文件（Flash）的次数和每次日志调用的耗时；
+以及文本日志和二进制日志（binary=True）每条消息的耗时和占用字节数。
+
+用法:  python3 tools/log_bench.py [行数]
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Thonny-projects"))
+
+# logger 使用 MicroPython 的 time.ticks_ms / ticks_diff
+time.ticks_ms = lambda: int(time.monotonic() * 1000)
+time.ticks_diff = lambda a, b: a - b
+
+from logger import SimpleLogger  # noqa: E402
+from log_messages import MSG_PUBLISHED  # noqa: E402
+
+LINES = 2000
+CONFIGS = [
+    ("每行写入", 0, 0),
+    ("缓冲 256B", 256, 30),
+    ("缓冲 512B", 512, 30),
+    ("缓冲 1KB", 1024, 30),
+]
+
+
+def run(lines, buffer_size, flush_interval):
+    """
+    用给定缓冲设置写入 lines 行日志（每 50 行一条 ERROR）
+
+    Returns:
+        tuple: (写入次数, 平均耗时 us, 最大耗时 us)
+    """
+    fd, path = tempfile.mkstemp(suffix=".txt")
+    os.close(fd)
+    logger = SimpleLogger(path, max_size=1 << 30,
+                          buffer_size=buffer_size, flush_interval=flush_interval)
+    worst = total = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(lines):
+            start = time.perf_counter()
+            if i % 50 == 49:
+                logger.error(f"MQTT 连接失败: OSError - {i}")
+            else:
+                logger.info(f"数据已发布: 温度=21.{i % 10}°C, 湿度=45.{i % 7}%")
+            took = time.perf_counter() - start
+            total += took
+            worst = max(worst, took)
+        logger.close()
+    os.remove(path)
+    return logger.writes, total / lines * 1e6, worst * 1e6
+
+
+def run_format(lines, binary):
+    """
+    用文本或二进制日志记录 lines 条发布消息
+
+    Returns:
+        tuple: (平均耗时 us, 每条字节数)
+    """
+    fd, path = tempfile.mkstemp(suffix=".log")
+    os.close(fd)
+    logger = SimpleLogger(path, max_size=1 << 30, binary=binary)
+    logger.flush()
+    start_size = logger.size
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for i in range(lines):
+            logger.event(SimpleLogger.INFO, MSG_PUBLISHED, 21.0 + i % 10 / 10, 45.0 + i % 7 / 10)
+        took = time.perf_counter() - start
+        logger.close()
+    size = os.stat(path)[6] - start_size
+    os.remove(path)
+    return took / lines * 1e6, size / lines
+
+
+def main():
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else LINES
+    print(f"{lines} 行日志（每 50 行一条 ERROR）")
+    print("{:<10} {:>8} {:>10} {:>10}".format("设置", "写入次数", "平均us", "最大us"))
+    for name, buffer_size, flush_interval in CONFIGS:
+        writes, avg, worst = run(lines, buffer_size, flush_interval)
+        print("{:<10} {:>8} {:>10.1f} {:>10.1f}".format(name, writes, avg, worst))
+
+    print()
+    print("{:<10} {:>10} {:>10}".format("格式", "平均us", "字节/条"))
+    for name, binary in (("文本", False), ("二进制", True)):
+        avg, per_line = run_format(lines, binary)
+        print("{:<10} {:>10.1f} {:>10.1f}".format(name, avg, per_line))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+二进制日志解码（在电脑上用 CPython 运行）
+把 SimpleLogger(binary=True) 写的日志文件还原成文本，格式与文本日志相同:
+    [MM-DD HH:MM:SS] [级别] 消息
+
+消息格式取自 Thonny-projects/log_messages.py，应与设备上的版本一致。
+时间由文件中的时钟同步记录和 ticks_ms 推算；时钟同步前的记录只显示 ticks。
+
+用法:  python3 tools/log_decode.py [--epoch 2000] 文件 [文件 ...]
+例如:  python3 tools/log_decode.py _log.bin.2 _log.bin.1 _log.bin   （从旧到新）
+"""
+
+import argparse
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Thonny-projects"))
+
+from log_messages import MESSAGES  # noqa: E402
+
+RECORD_SIZE = 20
+MSG_TEXT = 0xFFFF
+MSG_CLOCK = 0xFFFE
+LEVEL_NAMES = {0: "DEBUG", 1: "INFO", 2: "WARN", 3: "ERROR"}
+TICKS_PERIOD = 1 << 30  # MicroPython ticks_ms 的回绕周期
+
+# MicroPython 固件的 time.time() 纪元
+EPOCHS = {1970: 0, 2000: 946684800}
+
+
+def records(data):
+    """
+    逐条解析二进制日志
+
+    Yields:
+        tuple: (ticks_ms, 级别, 消息 ID, 参数元组, 文本或 None)
+    """
+    i = 0
+    while i + RECORD_SIZE <= len(data):
+        ticks, msg_id, level, meta = struct.unpack_from("<IHBB", data, i)
+        argc = meta & 0x0F
+        args = []
+        for k in range(argc):
+            fmt = "<f" if meta >> (4 + k) & 1 else "<i"
+            args.append(struct.unpack_from(fmt, data, i + 8 + 4 * k)[0])
+        i += RECORD_SIZE
+        text = None
+        if msg_id == MSG_TEXT:
+            text = data[i:i + args[0]].decode("utf-8", "replace")
+            i += args[0]
+        yield ticks, level, msg_id, tuple(args), text
+    if i < len(data):
+        print(f"（文件末尾有 {len(data) - i} 字节不完整的记录，已忽略）", file=sys.stderr)
+
+
+def format_message(msg_id, args, text):
+    """按消息目录还原消息文字"""
+    if text is not None:
+        return text
+    fmt = MESSAGES.get(msg_id)
+    if fmt is None:
+        return f"未知消息 {msg_id} {list(args)}"
+    try:
+        return fmt.format(*args)
+    except (IndexError, ValueError):
+        return f"{fmt} {list(args)}"
+
+
+def decode(path, epoch_offset, out=sys.stdout):
+    """
+    解码一个日志文件并输出文本
+
+    Args:
+        path: 二进制日志文件
+        epoch_offset: 设备纪元相对 1970 年的秒数
+        out: 输出流
+
+    Returns:
+        int: 解码的记录数
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    clock = None  # (ticks_ms, 设备时间)
+    count = 0
+    for ticks, level, msg_id, args, text in records(data):
+        count += 1
+        if msg_id == MSG_CLOCK:
+            clock = (ticks, args[0])
+            continue
+        if clock:
+            elapsed = ((ticks - clock[0]) % TICKS_PERIOD) / 1000
+            t = time.localtime(clock[1] + epoch_offset + elapsed)
+            stamp = "{:02d}-{:02d} {:02d}:{:02d}:{:02d}".format(t[1], t[2], t[3], t[4], t[5])
+        else:
+            stamp = f"ticks {ticks}"
+        name = LEVEL_NAMES.get(level, str(level))
+        out.write(f"[{stamp}] [{name}] {format_message(msg_id, args, text)}\n")
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="二进制日志解码")
+    parser.add_argument("files", nargs="+", help="日志文件（按从旧到新的顺序）")
+    parser.add_argument("--epoch", type=int, choices=sorted(EPOCHS), default=1970,
+                        help="设备 time.time() 的纪元年份，默认 1970")
+    args = parser.parse_args()
+    for path in args.files:
+        decode(path, EPOCHS[args.epoch])
+
+
+if __name__ == "__main__":
+    main()
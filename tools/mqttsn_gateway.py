@@ -0,0 +1,319 @@
+"""
+MQTT-SN 网关替身（在电脑上用 CPython 运行）
+在 UDP 端口接收 MQTT-SN 1.2 报文，转换成普通 MQTT 发布到服务器，
+并把订阅到的消息转发回 MQTT-SN 客户端。只实现 umqtt.sn 用到的报文
+（CONNECT / REGISTER / PUBLISH / SUBSCRIBE / PINGREQ / DISCONNECT，QoS -1、0、1），
+用于在一台电脑上测试整条链路，不用于生产环境。
+
+每个 MQTT-SN 客户端对应一条到服务器的 MQTT 连接；QoS -1 消息不需要连接，
+通过网关自己的连接以 QoS 0 发布。
+
+用法:  python3 tools/mqttsn_gateway.py [--broker HOST:PORT] [--port 1884] [--topic ID=TOPIC ...]
+例如:  python3 tools/mqttsn_gateway.py --broker 127.0.0.1:1883 --topic 1=sensor/dht22/2/data
+"""
+
+import argparse
+import select
+import socket
+import struct
+import time
+
+import host_compat
+
+host_compat.install()
+
+from umqtt.simple import MQTTClient  # noqa: E402
+
+CONNECT = 0x04
+CONNACK = 0x05
+REGISTER = 0x0A
+REGACK = 0x0B
+PUBLISH = 0x0C
+PUBACK = 0x0D
+SUBSCRIBE = 0x12
+SUBACK = 0x13
+PINGREQ = 0x16
+PINGRESP = 0x17
+DISCONNECT = 0x18
+
+# 返回码
+ACCEPTED = 0x00
+INVALID_TOPIC_ID = 0x02
+NOT_SUPPORTED = 0x03
+
+# 主题 ID 类型
+TID_NORMAL = 0
+TID_PREDEF = 1
+TID_SHORT = 2
+
+
+class Session:
+    """一个 MQTT-SN 客户端的会话：到服务器的连接和注册过的主题"""
+
+    def __init__(self, addr, mqtt, duration):
+        self.addr = addr
+        self.mqtt = mqtt
+        self.duration = duration  # 客户端声明的心跳周期（秒），0 表示不检查
+        self.last_rx = time.monotonic()
+        self.ids = {}    # 主题 -> 主题 ID
+        self.names = {}  # 主题 ID -> 主题
+
+    def topic_id(self, topic):
+        """
+        返回主题的 ID，未注册过则分配新的 ID
+
+        Returns:
+            tuple: (主题 ID, 是否新分配)
+        """
+        tid = self.ids.get(topic)
+        if tid is not None:
+            return tid, False
+        tid = len(self.ids) + 1
+        self.ids[topic] = tid
+        self.names[tid] = topic
+        return tid, True
+
+
+class Gateway:
+    """MQTT-SN 到 MQTT 的转换网关"""
+
+    def __init__(self, broker, port=1884, predefined=None, bind="0.0.0.0"):
+        """
+        初始化网关并绑定 UDP 端口
+
+        Args:
+            broker: MQTT 服务器地址 (host, port)
+            port: 监听的 UDP 端口，0 表示由系统分配
+            predefined: 预定义主题 {主题 ID: 主题}，需与客户端一致
+            bind: 监听地址
+        """
+        self.broker = broker
+        self.pnames = {}
+        self.predefined = {}
+        for tid, topic in (predefined or {}).items():
+            if isinstance(topic, str):
+                topic = topic.encode()
+            self.pnames[tid] = topic
+            self.predefined[topic] = tid
+        self.sessions = {}   # 客户端地址 -> Session
+        self.anon = None     # 转发 QoS -1 消息用的连接
+        self.msg_id = 0
+        self.forwarded = 0   # 转发到服务器的消息数
+        self.delivered = 0   # 转发给客户端的消息数
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.bind((bind, port))
+        self.port = self.udp.getsockname()[1]
+
+    # ==================== 报文收发 ====================
+    def send(self, addr, typ, body=b""):
+        """向客户端发送一个 MQTT-SN 报文"""
+        n = len(body) + 2
+        if n > 255:
+            head = struct.pack("!BHB", 1, n + 2, typ)
+        else:
+            head = bytes((n, typ))
+        self.udp.sendto(head + body, addr)
+
+    def _next_id(self):
+        self.msg_id = self.msg_id % 65535 + 1
+        return self.msg_id
+
+    def _client(self, cid, clean_session=True):
+        """建立一条到服务器的 MQTT 连接"""
+        mqtt = MQTTClient(cid, self.broker[0], self.broker[1], timeout_ms=5000)
+        mqtt.connect(clean_session)
+        return mqtt
+
+    def poll(self, timeout=0.1):
+        """
+        处理一轮收到的 UDP 报文和服务器消息
+
+        Args:
+            timeout: 没有数据时最长等待时间（秒）
+        """
+        socks = {self.udp: None}
+        for session in self.sessions.values():
+            socks[session.mqtt.sock] = session
+        readable, _, _ = select.select(list(socks), [], [], timeout)
+        for sock in readable:
+            session = socks[sock]
+            if session is None:
+                data, addr = self.udp.recvfrom(65535)
+                self.handle(data, addr)
+                continue
+            try:
+                # 一次读到的多条消息都在 umqtt 的缓冲区里，处理完为止
+                session.mqtt.check_msg()
+                while session.mqtt.pending():
+                    session.mqtt.check_msg()
+            except Exception as e:
+                print(f"{session.addr}: 服务器连接断开 ({e})")
+                self.drop(session)
+        self._expire()
+
+    def serve_forever(self):
+        """持续运行网关"""
+        while True:
+            self.poll()
+
+    def _expire(self):
+        """移除超过 1.5 个心跳周期没有报文的会话"""
+        now = time.monotonic()
+        for session in list(self.sessions.values()):
+            if session.duration and now - session.last_rx > session.duration * 1.5:
+                print(f"{session.addr}: 心跳超时")
+                self.drop(session)
+
+    def drop(self, session):
+        """结束会话并断开它的服务器连接"""
+        self.sessions.pop(session.addr, None)
+        try:
+            session.mqtt.disconnect()
+        except OSError:
+            pass
+
+    # ==================== MQTT-SN 报文处理 ====================
+    def handle(self, data, addr):
+        """
+        处理一个 MQTT-SN 报文
+
+        Args:
+            data: 收到的数据报
+            addr: 客户端地址
+        """
+        if len(data) < 2:
+            return
+        if data[0] == 1:
+            typ, body = data[3], data[4:struct.unpack("!H", data[1:3])[0]]
+        else:
+            typ, body = data[1], data[2:data[0]]
+        session = self.sessions.get(addr)
+        if session:
+            session.last_rx = time.monotonic()
+
+        if typ == CONNECT:
+            self._on_connect(addr, body)
+        elif typ == PUBLISH:
+            self._on_publish(session, addr, body)
+        elif session is None:
+            # 其他报文都需要先 CONNECT
+            if typ == REGISTER:
+                self.send(addr, REGACK, body[:4] + bytes((NOT_SUPPORTED,)))
+            elif typ != DISCONNECT:
+                self.send(addr, DISCONNECT)
+        elif typ == REGISTER:
+            mid = body[2:4]
+            tid, _ = session.topic_id(bytes(body[4:]))
+            self.send(addr, REGACK, struct.pack("!H", tid) + mid + bytes((ACCEPTED,)))
+        elif typ == SUBSCRIBE:
+            self._on_subscribe(session, body)
+        elif typ == PINGREQ:
+            self.send(addr, PINGRESP)
+        elif typ == DISCONNECT:
+            self.drop(session)
+            self.send(addr, DISCONNECT)
+
+    def _on_connect(self, addr, body):
+        flags, _, duration = struct.unpack("!BBH", body[:4])
+        cid = bytes(body[4:])
+        old = self.sessions.get(addr)
+        if old:
+            self.drop(old)
+        try:
+            mqtt = self._client(cid, bool(flags & 0x04))
+        except Exception as e:
+            print(f"{addr}: 连接服务器失败 ({e})")
+            self.send(addr, CONNACK, bytes((NOT_SUPPORTED,)))
+            return
+        session = Session(addr, mqtt, duration)
+        mqtt.set_callback(lambda topic, msg: self._deliver(session, topic, msg))
+        self.sessions[addr] = session
+        self.send(addr, CONNACK, bytes((ACCEPTED,)))
+        print(f"{addr}: {cid.decode()} 已连接")
+
+    def _topic(self, session, tt, tid):
+        """按主题 ID 类型查出主题名，未知返回 None"""
+        if tt == TID_PREDEF:
+            return self.pnames.get(tid)
+        if tt == TID_SHORT:
+            return struct.pack("!H", tid)
+        if session:
+            return session.names.get(tid)
+        return None
+
+    def _on_publish(self, session, addr, body):
+        flags, tid, mid = struct.unpack("!BHH", body[:5])
+        qos = (flags >> 5) & 3
+        topic = self._topic(session, flags & 3, tid)
+        if topic is None or (qos != 3 and session is None):
+            if qos == 1 or topic is None:
+                self.send(addr, PUBACK, struct.pack("!HHB", tid, mid, INVALID_TOPIC_ID))
+            return
+        if session is not None:
+            mqtt = session.mqtt
+        else:
+            # QoS -1: 客户端没有连接
+            if self.anon is None:
+                self.anon = self._client(f"mqttsn-gw-{self.port}")
+            mqtt = self.anon
+        mqtt.publish(topic, bytes(body[5:]), bool(flags & 0x10), 1 if qos == 1 else 0)
+        self.forwarded += 1
+        if qos == 1:
+            self.send(addr, PUBACK, struct.pack("!HHB", tid, mid, ACCEPTED))
+
+    def _on_subscribe(self, session, body):
+        flags, mid = struct.unpack("!BH", body[:3])
+        tt = flags & 3
+        qos = min((flags >> 5) & 3, 1)
+        if tt == TID_PREDEF:
+            tid = struct.unpack("!H", body[3:5])[0]
+            topic = self.pnames.get(tid)
+        else:
+            topic = bytes(body[3:])
+            tid = 0
+        if topic is None:
+            self.send(session.addr, SUBACK, struct.pack("!BHHB", 0, 0, mid, INVALID_TOPIC_ID))
+            return
+        session.mqtt.subscribe(topic, qos)
+        if tt == TID_NORMAL and b"+" not in topic and b"#" not in topic:
+            tid, _ = session.topic_id(topic)
+        self.send(session.addr, SUBACK, struct.pack("!BHHB", qos << 5, tid, mid, ACCEPTED))
+
+    def _deliver(self, session, topic, msg):
+        """把服务器的消息转发给客户端，需要时先 REGISTER 主题"""
+        if topic in self.predefined:
+            tt, tid = TID_PREDEF, self.predefined[topic]
+        elif len(topic) == 2:
+            tt, tid = TID_SHORT, struct.unpack("!H", topic)[0]
+        else:
+            tt = TID_NORMAL
+            tid, new = session.topic_id(topic)
+            if new:
+                self.send(session.addr, REGISTER, struct.pack("!HH", tid, self._next_id()) + topic)
+        self.send(session.addr, PUBLISH, struct.pack("!BHH", tt, tid, 0) + msg)
+        self.delivered += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MQTT-SN 网关替身")
+    parser.add_argument("--broker", default="127.0.0.1:1883", help="MQTT 服务器 HOST:PORT")
+    parser.add_argument("--port", type=int, default=1884, help="监听的 UDP 端口")
+    parser.add_argument("--topic", action="append", default=[], metavar="ID=TOPIC",
+                        help="预定义主题，可重复")
+    args = parser.parse_args()
+
+    host, _, port = args.broker.rpartition(":")
+    predefined = {}
+    for item in args.topic:
+        tid, _, topic = item.partition("=")
+        predefined[int(tid)] = topic
+    gateway = Gateway((host, int(port)), args.port, predefined)
+    print(f"MQTT-SN 网关监听 UDP {gateway.port}，转发到 {args.broker}")
+    try:
+        gateway.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+MQTT 发布写入基准测试（在电脑上用 CPython 运行）
+比较 umqtt 1.4.0 原来的发布方式（固定报头、主题长度、主题、报文 ID、消息内容分别 write）
+和现在整帧一次 write 的方式，统计每次发布的 write 调用次数、发出的 TCP 报文段数和耗时。
+
+客户端 socket 关闭 Nagle（TCP_NODELAY），和 Pico W 上每次小 write 都可能单独成段的情况一致；
+报文段数从 Linux 的 TCP_INFO 读取，其他系统上显示为 "-"。
+QoS 0 连续发布时 Linux 会把排队中的小 write 合并（autocorking），报文段数偏少；
+QoS 1 每次等待 PUBACK，更接近 Pico 上逐条发布的情况。
+
+用法:  python3 tools/publish_bench.py [发布次数]
+"""
+
+import socket
+import struct
+import sys
+import time
+
+import host_compat
+from failover_test import StandInBroker
+
+COUNT = 1000
+TOPIC = b"sensors/pico/dht22"
+PAYLOAD = b'{"created_at": "2025-01-01T08:00:00+08:00", "temperature": 21.5, "humidity": 45.2}'
+# struct tcp_info 中 tcpi_segs_out 的偏移（Linux 4.2 起）
+TCPI_SEGS_OUT = 136
+
+writes = 0
+
+
+def count_writes():
+    """让 host_compat 的 socket 统计 write 调用次数"""
+    write = host_compat._Socket.write
+
+    def counted(self, buf):
+        global writes
+        writes += 1
+        return write(self, buf)
+
+    host_compat._Socket.write = counted
+
+
+def segs_out(client):
+    """返回客户端 socket 已发出的 TCP 报文段数，不支持时返回 None"""
+    try:
+        info = client.sock._s.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 256)
+    except (AttributeError, OSError):
+        return None
+    if len(info) < TCPI_SEGS_OUT + 4:
+        return None
+    return struct.unpack_from("I", info, TCPI_SEGS_OUT)[0]
+
+
+def baseline_publish(client, topic, msg, retain=False, qos=0):
+    """按 umqtt 1.4.0 的 publish() 逐段写入同一个 PUBLISH 帧"""
+    sock = client.sock
+    pkt = bytearray(b"\x30\0\0\0")
+    pkt[0] |= qos << 1 | retain
+    sz = 2 + len(topic) + len(msg)
+    if qos > 0:
+        sz += 2
+    i = 1
+    while sz > 0x7F:
+        pkt[i] = (sz & 0x7F) | 0x80
+        sz >>= 7
+        i += 1
+    pkt[i] = sz
+    sock.write(pkt[: i + 1])
+    sock.write(struct.pack("!H", len(topic)))
+    sock.write(topic)
+    if qos > 0:
+        struct.pack_into("!H", pkt, 0, client._next_pid())
+        sock.write(pkt[:2])
+    sock.write(msg)
+    if qos == 1:
+        while client.wait_msg() != 0x40:
+            pass
+
+
+def run(client, publish, qos, count):
+    """
+    用 publish 发布 count 条消息
+
+    Returns:
+        tuple: (每次 write 次数, 每次报文段数或 None, 平均耗时 us)
+    """
+    global writes
+    writes = 0
+    segs = segs_out(client)
+    start = time.perf_counter()
+    for _ in range(count):
+        publish(client, TOPIC, PAYLOAD, False, qos)
+    took = time.perf_counter() - start
+    if segs is not None:
+        segs = (segs_out(client) - segs) / count
+    return writes / count, segs, took / count * 1e6
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else COUNT
+    host_compat.install()
+    count_writes()
+    from umqtt.simple import MQTTClient
+
+    broker = StandInBroker("bench")
+    client = MQTTClient("publish-bench", "127.0.0.1", broker.port, timeout_ms=2000)
+    client.connect()
+    client.sock._s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def current(client, topic, msg, retain, qos):
+        client.publish(topic, msg, retain, qos)
+
+    print(f"{count} 次发布，消息 {len(PAYLOAD)} 字节")
+    print("{:<12} {:>4} {:>8} {:>8} {:>8}".format("方式", "QoS", "write/次", "报文段/次", "平均us"))
+    for qos in (0, 1):
+        for name, publish in (("1.4.0 分段", baseline_publish), ("整帧", current)):
+            per_write, per_seg, avg = run(client, publish, qos, count)
+            seg = "-" if per_seg is None else f"{per_seg:.2f}"
+            print("{:<12} {:>4} {:>8.2f} {:>8} {:>8.1f}".format(name, qos, per_write, seg, avg))
+    client.disconnect()
+
+
+if __name__ == "__main__":
+    main()
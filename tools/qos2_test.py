@@ -0,0 +1,119 @@
+"""
+MQTT QoS 2 测试（在电脑上用 CPython 运行）
+用本地 MQTT 服务器替身检查 umqtt.simple 的 QoS 2 流程:
+1. 发送: publish() 和 publish_many() 同时有多条 QoS 2 消息在途（PUBLISH / PUBREC / PUBREL / PUBCOMP）
+2. 接收: 同一条 QoS 2 消息收到两次后才收到 PUBREL，只应交给回调一次
+3. 新会话: 消息未释放时断线，以 clean_session 重连后，服务器重新使用同一报文 ID 的新消息应交给回调
+
+用法:  python3 tools/qos2_test.py
+"""
+
+import struct
+import sys
+import time
+
+import host_compat
+from failover_test import StandInBroker
+
+COUNT = 50
+MAX_INFLIGHT = 8
+
+
+def wait_for(cond, timeout=2):
+    """等待 cond() 成立，超时返回 False"""
+    deadline = time.monotonic() + timeout
+    while not cond():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def max_outstanding(received):
+    """服务器看到的最大在途 QoS 2 消息数（已收到 PUBLISH、尚未收到 PUBREL）"""
+    open_ids = set()
+    most = 0
+    for op, body in received:
+        if op & 0xF6 == 0x34:
+            topic_len = struct.unpack("!H", body[:2])[0]
+            open_ids.add(body[2 + topic_len:4 + topic_len])
+            most = max(most, len(open_ids))
+        elif op == 0x62:
+            open_ids.discard(body[:2])
+    return most
+
+
+def test_outgoing(client, broker):
+    """发送 2 x COUNT 条 QoS 2 消息，检查每条都完成且有多条同时在途"""
+    broker.received.clear()
+    for i in range(COUNT):
+        client.publish("qos2/test", str(i), qos=2)
+    client.wait_acks()
+    client.publish_many(("qos2/test", str(i), 2, False) for i in range(COUNT))
+
+    ok = wait_for(lambda: sum(op == 0x62 for op, _ in broker.received) >= 2 * COUNT)
+    publishes = sum(op & 0xF0 == 0x30 for op, _ in broker.received)
+    pubrels = sum(op == 0x62 for op, _ in broker.received)
+    most = max_outstanding(broker.received)
+    print(f"发送: PUBLISH={publishes} PUBREL={pubrels} 最多同时在途={most} "
+          f"未完成={client._nifl} 重发={client.metrics()['retries']}")
+    return ok and publishes == pubrels == 2 * COUNT and client._nifl == 0 and most > 1
+
+
+def test_incoming(client, broker, delivered):
+    """服务器重发一条未释放的 QoS 2 消息后再发 PUBREL，检查只交付一次"""
+    broker.received.clear()
+    delivered.clear()
+    publish = b"\x34\x09\x00\x04in/2\x00\x07x"
+    broker.send(publish)
+    broker.send(b"\x3c" + publish[1:])  # 同一报文 ID，带 DUP
+    broker.send(b"\x62\x02\x00\x07")
+    for _ in range(3):
+        client.wait_msg()
+    # 释放后同一报文 ID 是一条新消息
+    broker.send(publish)
+    broker.send(b"\x62\x02\x00\x07")
+    for _ in range(2):
+        client.wait_msg()
+
+    ok = wait_for(lambda: len(broker.received) >= 5)
+    acks = [op for op, body in broker.received if body[:2] == b"\x00\x07"]
+    print(f"接收: 交付={len(delivered)} 服务器收到={['%02x' % op for op in acks]}")
+    return ok and len(delivered) == 2 and acks == [0x50, 0x50, 0x70, 0x50, 0x70]
+
+
+def test_new_session(client, broker, delivered):
+    """QoS 2 消息交付后、PUBREL 之前重连，新会话中同一报文 ID 的消息是新消息"""
+    delivered.clear()
+    broker.send(b"\x34\x09\x00\x04in/2\x00\x07x")
+    client.wait_msg()
+    client.connect(clean_session=True)
+    broker.send(b"\x34\x09\x00\x04in/2\x00\x07y")
+    broker.send(b"\x62\x02\x00\x07")
+    for _ in range(2):
+        client.wait_msg()
+    print(f"新会话: 交付={[msg for _, msg in delivered]}")
+    return [msg for _, msg in delivered] == [b"x", b"y"]
+
+
+def run():
+    host_compat.install()
+    from umqtt.simple import MQTTClient
+
+    broker = StandInBroker("qos2")
+    delivered = []
+    client = MQTTClient("qos2-test", "127.0.0.1", broker.port,
+                        max_inflight=MAX_INFLIGHT, timeout_ms=2000)
+    client.set_callback(lambda topic, msg: delivered.append((topic, msg)))
+    client.connect()
+    ok = test_outgoing(client, broker)
+    ok = test_incoming(client, broker, delivered) and ok
+    ok = test_new_session(client, broker, delivered) and ok
+    client.disconnect()
+    return ok
+
+
+if __name__ == "__main__":
+    ok = run()
+    print("通过" if ok else "失败")
+    sys.exit(0 if ok else 1)